@@ -0,0 +1 @@
+../msam/chalicelib/alarm_catalog.py
\ No newline at end of file
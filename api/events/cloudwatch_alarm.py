@@ -5,15 +5,20 @@ This Lambda is responsible for receiving and storing CloudWatch alarm events.
 This Lambda must be installed into each region where alarms are subscribed to by MSAM nodes.
 """
 
+import datetime
 import os
-import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
-from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 from botocore.config import Config
 
+# shared with the API, packaged through links to the modules in api/msam/chalicelib
+import alarm_catalog
+import counter_maps
+
 # user-agent config
 STAMP = os.environ["BUILD_STAMP"]
 MSAM_BOTO3_CONFIG = Config(user_agent="aws-media-services-applications-mapper/{stamp}/cloudwatch_alarm.py".format(stamp=STAMP))
@@ -22,6 +27,18 @@ ALARMS_TABLE_NAME = os.environ["ALARMS_TABLE_NAME"]
 TABLE_REGION = os.environ["EVENTS_TABLE_REGION"]
 DYNAMO_RESOURCE = boto3.resource('dynamodb', region_name=TABLE_REGION, config=MSAM_BOTO3_CONFIG)
 ALARMS_TABLE = DYNAMO_RESOURCE.Table(ALARMS_TABLE_NAME)
+# the API's cached alarm catalog, one item per metric alarm keyed by alarm ARN
+CONTENT_TABLE = DYNAMO_RESOURCE.Table(os.environ["CONTENT_TABLE_NAME"])
+
+# the API's subscriber alarm counts per state are counter maps in the settings table
+SETTINGS_TABLE = DYNAMO_RESOURCE.Table(os.environ["SETTINGS_TABLE_NAME"])
+
+# number of subscriber rows updated at once
+SUBSCRIBER_UPDATE_WORKERS = 10
+
+# CloudWatch clients by region, only needed when an event lacks the alarm state
+CLOUDWATCH_CLIENTS = {}
+
 
 def lambda_handler(event, _):
     """
@@ -33,44 +50,98 @@ def lambda_handler(event, _):
         # process the data we got from the alarm state change event
         region = event['region']
         alarm_name = event['detail']['alarmName']
-        CLOUDWATCH_RESOURCE = boto3.resource('cloudwatch', region_name=region)
-        alarm = CLOUDWATCH_RESOURCE.Alarm(alarm_name)
-
-        region_alarm_name = "{}:{}".format(region, alarm_name)        
-        state = alarm.state_value
-        namespace = alarm.namespace
-        state_updated = int(alarm.state_updated_timestamp.timestamp())
-
-        subscribers = subscribers_to_alarm(region_alarm_name)
-        for resource_arn in subscribers:
-            # only update alarm if it's already in alarm DB through node subscription
-            response = ALARMS_TABLE.update_item(
-                UpdateExpression='SET StateValue = :state, Updated = :updated, StateUpdated = :stateupdated',
-                ConditionExpression=Attr('RegionAlarmName').eq(region_alarm_name),
-                Key={'RegionAlarmName': region_alarm_name, 'ResourceArn': resource_arn},
-                ExpressionAttributeValues={':state': state, ':updated': updated_timestamp, ':stateupdated': state_updated}
-            )
-            print("{} updated via CloudWatch alarm change state event".format(resource_arn))
+        region_alarm_name = "{}:{}".format(region, alarm_name)
+        state, state_updated = alarm_state(event)
+        # only rows whose stored state differs are written
+        stale = [item for item in subscriber_records(region_alarm_name)
+                 if item.get("StateValue") != state or item.get("StateUpdated") != state_updated]
+        print("{} of the subscribers of {} need an update".format(len(stale), region_alarm_name))
+        values = {':state': state, ':updated': updated_timestamp, ':stateupdated': state_updated}
+        # the resource's client is thread safe, unlike the Table resource itself
+        with ThreadPoolExecutor(max_workers=SUBSCRIBER_UPDATE_WORKERS) as executor:
+            updated = list(executor.map(lambda item: update_subscriber(region_alarm_name, item["ResourceArn"], values), stale))
+        # move the updated rows between the per-state counts, the rows read above hold their old state
+        deltas = {}
+        for item, row_updated in zip(stale, updated):
+            if row_updated and item.get("StateValue") != state:
+                if item.get("StateValue"):
+                    old_deltas = deltas.setdefault(item["StateValue"], {})
+                    old_deltas[item["ResourceArn"]] = old_deltas.get(item["ResourceArn"], 0) - 1
+                new_deltas = deltas.setdefault(state, {})
+                new_deltas[item["ResourceArn"]] = new_deltas.get(item["ResourceArn"], 0) + 1
+        # counts the API has not built yet are skipped, the first read builds them from the alarms table
+        for counted_state, state_deltas in deltas.items():
+            try:
+                counter_maps.change_counter_map(SETTINGS_TABLE, counter_maps.ALARM_STATE_COUNTS_KEY.format(counted_state), state_deltas)
+            except ClientError as error:
+                print(error)
+        # the event's resource is the alarm ARN
+        for alarm_arn in event.get('resources', []):
+            alarm_catalog.update_catalog_state(CONTENT_TABLE, alarm_arn, state, state_updated)
     except ClientError as error:
-        if error.response['Error']['Code']=='ConditionalCheckFailedException':  
-            print("No update made. Alarm key {} does not exist in database.".format(region_alarm_name)) 
         print(error)
     return True
 
-def subscribers_to_alarm(region_alarm_name):
+
+def alarm_state(event):
     """
-    Returns subscribed nodes of a CloudWatch alarm in a region.
+    Return the state and state timestamp of the alarm from the event detail.
+    The alarm is described only if the event does not carry them.
+    """
+    detail_state = event['detail'].get('state', {})
+    state = detail_state.get('value')
+    timestamp = detail_state.get('timestamp')
+    if state and timestamp:
+        return state, int(datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%f%z').timestamp())
+    region = event['region']
+    if region not in CLOUDWATCH_CLIENTS:
+        CLOUDWATCH_CLIENTS[region] = boto3.client('cloudwatch', region_name=region, config=MSAM_BOTO3_CONFIG)
+    response = CLOUDWATCH_CLIENTS[region].describe_alarms(AlarmNames=[event['detail']['alarmName']])
+    alarm = (response['CompositeAlarms'] + response['MetricAlarms'])[0]
+    return alarm['StateValue'], int(alarm['StateUpdatedTimestamp'].timestamp())
+
+
+def update_subscriber(region_alarm_name, resource_arn, values):
+    """
+    Update the state of one subscriber's alarm row if it is still subscribed. Returns True if the row was updated.
     """
-    subscribers = set()
+    try:
+        # only update alarm if it's already in alarm DB through node subscription
+        DYNAMO_RESOURCE.meta.client.update_item(
+            TableName=ALARMS_TABLE_NAME,
+            UpdateExpression='SET StateValue = :state, Updated = :updated, StateUpdated = :stateupdated',
+            ConditionExpression='attribute_exists(RegionAlarmName)',
+            Key={'RegionAlarmName': region_alarm_name, 'ResourceArn': resource_arn},
+            ExpressionAttributeValues=values
+        )
+        print("{} updated via CloudWatch alarm change state event".format(resource_arn))
+        return True
+    except ClientError as error:
+        if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            print("No update made. Alarm key {} does not exist in database.".format(region_alarm_name))
+        print(error)
+    return False
+
+
+def subscriber_records(region_alarm_name):
+    """
+    Returns the stored alarm rows of the subscribed nodes of a CloudWatch alarm in a region.
+    """
+    items = []
     try:
         ddb_index_name = 'RegionAlarmNameIndex'
         response = ALARMS_TABLE.query(IndexName=ddb_index_name, KeyConditionExpression=Key('RegionAlarmName').eq(region_alarm_name))
-        for item in response["Items"]:
-            subscribers.add(item["ResourceArn"])
+        items = response["Items"]
         while "LastEvaluatedKey" in response:
-            response = ddb_table.query(IndexName=ddb_index_name, KeyConditionExpression=Key('RegionAlarmName').eq(region_alarm_name), ExclusiveStartKey=response['LastEvaluatedKey'])
-            for item in response["Items"]:
-                subscribers.add(item["ResourceArn"])
+            response = ALARMS_TABLE.query(IndexName=ddb_index_name, KeyConditionExpression=Key('RegionAlarmName').eq(region_alarm_name), ExclusiveStartKey=response['LastEvaluatedKey'])
+            items = items + response["Items"]
     except ClientError as error:
         print(error)
-    return sorted(subscribers)
\ No newline at end of file
+    return items
+
+
+def subscribers_to_alarm(region_alarm_name):
+    """
+    Returns subscribed nodes of a CloudWatch alarm in a region.
+    """
+    return sorted({item["ResourceArn"] for item in subscriber_records(region_alarm_name)})
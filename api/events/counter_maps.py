@@ -0,0 +1 @@
+../msam/chalicelib/counter_maps.py
\ No newline at end of file
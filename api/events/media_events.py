@@ -7,13 +7,16 @@ each region where Media Services are created.
 """
 
 import datetime
+import hashlib
 import os
 import json
-from random import randint
+import time
+import uuid
+from collections import Counter, OrderedDict
 from urllib.parse import unquote
 
 import boto3
-from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 from botocore.config import Config
 from jsonpath_ng import parse
@@ -27,6 +30,48 @@ DYNAMO_RESOURCE = boto3.resource('dynamodb', region_name=DYNAMO_REGION_NAME, con
 EVENTS_TABLE = DYNAMO_RESOURCE.Table(os.environ["EVENTS_TABLE_NAME"])
 CLOUDWATCH_EVENTS_TABLE = DYNAMO_RESOURCE.Table(os.environ["CLOUDWATCH_EVENTS_TABLE_NAME"])
 CONTENT_TABLE_NAME = os.environ["CONTENT_TABLE_NAME"]
+CONTENT_TABLE = DYNAMO_RESOURCE.Table(CONTENT_TABLE_NAME)
+
+# JSONPath expressions compiled once per container instead of on every event
+# catch all the various forms of ARN from the media services, for event types without known ARN paths
+ARN_EXPRESSION = parse('$..arn|aRN|resource-arn|channel_arn|multiplex_arn|flowArn|PlaybackConfigurationArn|resourceArn')
+ORIGIN_ENDPOINT_ID_EXPRESSION = parse('$..origin_endpoint_id')
+
+# least recently used cache of resource ARN to (service, channel class, expiration)
+CHANNEL_CLASS_CACHE = OrderedDict()
+CHANNEL_CLASS_CACHE_SIZE = 1000
+CHANNEL_CLASS_CACHE_SECONDS = 300
+
+# least recently used cache of (region, MediaPackage origin endpoint id) to endpoint ARN
+ENDPOINT_ARN_CACHE = OrderedDict()
+ENDPOINT_ARN_CACHE_SIZE = 1000
+# regions whose cached endpoints were loaded from the content table, with the time to reload them
+ENDPOINT_REGIONS_LOADED = {}
+ENDPOINT_REGION_RELOAD_SECONDS = 300
+# MediaPackage clients by region, only needed for endpoints missing from the content table
+MEDIAPACKAGE_CLIENTS = {}
+
+# alerts for the same (resource_arn, alarm_id, pipeline) within this many seconds are coalesced
+# the window is kept per container, so outside queue mode only alerts reaching the same warm container are coalesced
+COALESCE_SECONDS = int(os.environ.get("COALESCE_SECONDS", "60"))
+# most recent alert state and time, window start and flap count of each alert key seen by this container
+RECENT_ALERTS = OrderedDict()
+RECENT_ALERTS_SIZE = 10000
+
+# optional time bucketing of the CloudWatch events partition key ("none" or "day"), must match the API
+EVENT_BUCKETS = os.environ.get("CLOUDWATCH_EVENTS_BUCKETS", "none")
+
+# CloudWatch events sort keys are in microseconds, the sub-millisecond digits taken from the event id, must match the API
+SORT_KEY_SCALE = 1000000
+
+# optional per-resource event counts kept under the "<resource ARN>#rollup" partition, one item per interval, must match the API
+# each stored event adds an UpdateItem, in per-event mode this doubles the writes to the CloudWatch events table
+EVENT_ROLLUPS = os.environ.get("EVENT_ROLLUPS", "No") == "Yes"
+ROLLUP_PARTITION = "{}#rollup"
+ROLLUP_SECONDS = 300
+
+# comma separated detail-types that are not stored
+DROP_EVENT_TYPES = {name.strip() for name in os.environ.get("DROP_EVENT_TYPES", "").split(",") if name.strip()}
 
 
 def lambda_handler(event, _):
@@ -35,100 +80,423 @@ def lambda_handler(event, _):
     """
     try:
         print(event)
-        event["timestamp"] = int(datetime.datetime.strptime(
-            event["time"], '%Y-%m-%dT%H:%M:%SZ').timestamp())
-        event["expires"] = event["timestamp"] + int(os.environ["ITEM_TTL"])
-        event["detail"]["time"] = event["time"]
-
-        # catch all the various forms of ARN from the media services
-        arn_expr = parse('$..arn|aRN|resource-arn|channel_arn|multiplex_arn|flowArn|PlaybackConfigurationArn|resourceArn')
-        original_arns = [match.value for match in arn_expr.find(event)]
-        arns = []
-        # remove arn that is for userIdentity or inputSecurityGroup
-        # note: can't remove an item from a list that's being iterated over so doing it this way
-        for arn in original_arns:
-            if "user" in arn or "role" in arn or "inputSecurityGroup" in arn:
-                pass
-            else:
-                arns.append(arn)
-        if arns:
-            event["resource_arn"] = unquote(arns[0])
-        # for certain events, the ARN is not labeled as an ARN but instead put in the resources list
-        if not arns and event["resources"]:
-            if "vod" not in event["resources"][0]:
-                event["resource_arn"] = event["resources"][0]
-
-        # handle alerts
-        if "Alert" in event["detail-type"]:
-            # medialive alerts
-            if "MediaLive" in event["detail-type"]:
-                event["alarm_id"] = event["detail"]["alarm_id"]
-                event["alarm_state"] = event["detail"]["alarm_state"].lower()
-                event["detail"]["pipeline_state"] = get_pipeline_state(event)
-
-            # mediaconnect alerts
-            elif "MediaConnect" in event["detail-type"]:
-                event["alarm_id"] = event["detail"]["error-id"]
-                if event["detail"]["errored"] == True:
-                    event["alarm_state"] = "set"
-                else:
-                    event["alarm_state"] = "cleared"
-                event["detail"]["alert_type"] = event["detail"]["error-code"]
-                del event["detail"]["error-code"]
-                event["detail"]["message"] = event["detail"]["error-message"]
-                del event["detail"]["error-message"]
-            #print(event)
-            EVENTS_TABLE.put_item(Item=event)
-            print(event["detail-type"] + " stored.")
-        
-        # set the rest of the information needed for storing as regular CWE
-        # give timestamp a millisecond precision since it's sort key in CWE table
-        event["timestamp"] = event["timestamp"] * 1000 + randint(1, 999)
-        event["data"] = json.dumps(event["detail"])
-        event["type"] = event["detail-type"]
-        if "eventName" in event["detail"]:
-            event["type"] = event["type"] + ": " + event["detail"]["eventName"]
-
-        # handle specific cases depending on source
-        if event["source"] == "aws.medialive":
-            if "BatchUpdateSchedule" in event["type"]:
-                    print("Creating an ARN for BatchUpdateSchedule event.")
-                    event["resource_arn"] = "arn:aws:medialive:" + event['region'] + ":" + \
-                        event['account'] + ":channel:" + \
-                        event['detail']['requestParameters']['channelId']
-        elif event["source"] == "aws.mediapackage":
-            if "HarvestJob" in event["type"]:
-                print("Asking MediaPackage for the ARN of endpoint in a HarvestJob event.")
-                # to get the ARN, ask mediapackage to describe the origin endpoint
-                # the ARN available through resources is the HarvestJob ARN, not the endpoint
-                orig_id_expr = parse('$..origin_endpoint_id')
-                orig_id = [match.value for match in orig_id_expr.find(event)]
-                if orig_id:
-                    emp_client = boto3.client('mediapackage')
-                    response = emp_client.describe_origin_endpoint(
-                        Id=orig_id[0])
-                    event["resource_arn"] = response["Arn"]
-                else:
-                    print("Skipping this event. Origin ID not present in the HarvestJob event." + event["type"])
-        elif event["source"] == "aws.mediastore":
-            # for object state change the resource is the object, not the container 
-            # so the captured arn needs to be fixed
-            if "MediaStore Object State Change" in event["type"]:
-                temp_arn = event["resource_arn"].split('/')
-                event["resource_arn"] = temp_arn[0] + "/" + temp_arn[1]
-        
-        # if item has no resource arn, don't save in DB
-        if "resource_arn" in event:
-            #print(event)
+        alert, media_event = normalize_event(event)
+        if alert:
+            if not track_alert(alert)[0]:
+                print("Skipping duplicate alert {} for {}.".format(alert["alarm_id"], alert["resource_arn"]))
+                return True
+            if media_event and "flap_count" in alert:
+                media_event["flap_count"] = alert["flap_count"]
+            EVENTS_TABLE.put_item(Item=alert)
+            print(alert["detail-type"] + " stored.")
+        if media_event:
             print("Storing media service event.")
-            CLOUDWATCH_EVENTS_TABLE.put_item(Item=event)
+            CLOUDWATCH_EVENTS_TABLE.put_item(Item=media_event)
+            if EVENT_ROLLUPS:
+                update_rollups([media_event])
         else:
-            print("Skipping this event. " + event["type"])
+            print("Skipping this event. " + event["detail-type"])
     except ClientError as error:
         print(error)
     return True
 
 
+def queue_handler(event, _):
+    """
+    Entry point for batches of CloudWatch events delivered through an SQS queue.
+    All events are normalized first and then written with one batch writer per table.
+    Only failed records are returned to the queue, which moves them to its dead-letter queue after repeated failures.
+    """
+    normalized = []
+    failures = set()
+    for record in event["Records"]:
+        try:
+            alert, media_event = normalize_event(json.loads(record["body"]))
+        except (ClientError, KeyError, TypeError, ValueError) as error:
+            # a malformed or unlucky event must not hold back the rest of the batch
+            print("Failed to normalize message {}: {}".format(record["messageId"], repr(error)))
+            failures.add(record["messageId"])
+            continue
+        if alert and not (alert.get("resource_arn") and alert.get("alarm_id")):
+            # the events table is keyed on both, a single alert without them fails the whole batch write
+            print("Failed to store message {}: alert without resource_arn or alarm_id".format(record["messageId"]))
+            failures.add(record["messageId"])
+            continue
+        normalized.append((alert, media_event, record["messageId"]))
+    kept = coalesce_alerts(normalized)
+    alerts = [(alert, message_id) for alert, _, message_id in kept if alert]
+    print("{} records, {} alerts and {} media service events to store".format(
+        len(event["Records"]), len(alerts), len([media_event for _, media_event, _ in kept if media_event])))
+    failed = put_queued_items(EVENTS_TABLE, ["resource_arn", "alarm_id"], alerts)
+    # an alert that was not stored is not counted as seen, so its retry is not dropped as a duplicate
+    for alert, message_id in alerts:
+        if message_id in failed:
+            RECENT_ALERTS.pop(alert_key(alert), None)
+    # the media event of a failed alert is stored with its retry
+    media_events = [(media_event, message_id) for _, media_event, message_id in kept if media_event and message_id not in failed]
+    failed = failed | put_queued_items(CLOUDWATCH_EVENTS_TABLE, ["resource_arn", "timestamp"], media_events)
+    if EVENT_ROLLUPS:
+        # failed records are counted when their retry is stored
+        update_rollups([media_event for media_event, message_id in media_events if message_id not in failed])
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in sorted(failures | failed)]}
+
+
+def put_queued_items(table, pkeys, items):
+    """
+    Write (item, message id) pairs to a table with a batch writer, or with one put_item per item if the batch fails.
+    Returns the message ids of the items that could not be written.
+    """
+    try:
+        with table.batch_writer(overwrite_by_pkeys=pkeys) as batch:
+            for item, _ in items:
+                batch.put_item(Item=item)
+        return set()
+    except ClientError as error:
+        print(error)
+    # the writes are idempotent, so items the batch already wrote are simply written again
+    failed = set()
+    for item, message_id in items:
+        try:
+            table.put_item(Item=item)
+        except ClientError as error:
+            print("Failed to store message {}: {}".format(message_id, error))
+            failed.add(message_id)
+    return failed
+
+
+def update_rollups(media_events):
+    """
+    Add stored media service events to the counts of their resource and interval by type and alert state,
+    with one UpdateItem per resource and interval in the batch.
+    """
+    rollups = {}
+    for media_event in media_events:
+        resource_arn = media_event["resource_arn"]
+        if EVENT_BUCKETS == "day":
+            resource_arn = resource_arn.rsplit("#", 1)[0]
+        seconds = int(media_event["timestamp"]) // SORT_KEY_SCALE
+        key = (resource_arn, seconds - seconds % ROLLUP_SECONDS)
+        counts = rollups.setdefault(key, Counter())
+        counts["count#{}#{}".format(media_event.get("alarm_state", "none"), media_event["type"])] += 1
+    for (resource_arn, started), counts in rollups.items():
+        names = {"#expires": "expires", "#interval": "interval", "#total": "total"}
+        values = {":expires": started + ROLLUP_SECONDS + int(os.environ["ITEM_TTL"]), ":interval": ROLLUP_SECONDS, ":total": sum(counts.values())}
+        additions = ["#total :total"]
+        for index, (name, count) in enumerate(sorted(counts.items())):
+            names["#c{}".format(index)] = name
+            values[":c{}".format(index)] = count
+            additions.append("#c{index} :c{index}".format(index=index))
+        try:
+            # ADD creates missing counters, so the first event of an interval needs no separate put
+            CLOUDWATCH_EVENTS_TABLE.update_item(
+                Key={"resource_arn": ROLLUP_PARTITION.format(resource_arn), "timestamp": started * 1000},
+                UpdateExpression="SET #expires = :expires, #interval = :interval ADD " + ", ".join(additions),
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+        except ClientError as error:
+            print(error)
+
+
+def alert_key(alert):
+    """
+    Return the coalescing key of an alert.
+    """
+    return alert.get("resource_arn"), alert.get("alarm_id"), alert["detail"].get("pipeline")
+
+
+def track_alert(alert):
+    """
+    Record an alert in the coalescing window of its key. Returns (keep, new window).
+    An alert repeating the current state within the window is a duplicate and not kept,
+    a changed state within the window is a flap and counted in the alert's flap_count.
+    An alert older than the last one seen is out of order and not kept, it would overwrite a newer state.
+    Coalescing is best effort, each container only knows the alerts it handled.
+    """
+    key = alert_key(alert)
+    if key[1] is None or not COALESCE_SECONDS:
+        return True, True
+    recent = RECENT_ALERTS.get(key)
+    if recent is not None and alert["timestamp"] < recent["latest"]:
+        return False, False
+    new_window = recent is None or alert["timestamp"] - recent["started"] > COALESCE_SECONDS
+    if new_window:
+        recent = {"state": alert["alarm_state"], "started": alert["timestamp"], "latest": alert["timestamp"], "flaps": 0}
+    elif alert["alarm_state"] == recent["state"]:
+        recent["latest"] = alert["timestamp"]
+        return False, False
+    else:
+        recent["state"] = alert["alarm_state"]
+        recent["latest"] = alert["timestamp"]
+        recent["flaps"] = recent["flaps"] + 1
+        alert["flap_count"] = recent["flaps"]
+    RECENT_ALERTS[key] = recent
+    RECENT_ALERTS.move_to_end(key)
+    while len(RECENT_ALERTS) > RECENT_ALERTS_SIZE:
+        RECENT_ALERTS.popitem(last=False)
+    return True, new_window
+
+
+def coalesce_alerts(normalized):
+    """
+    Coalesce a batch of normalized (alert, media event, ...) entries. Duplicates are dropped and
+    flapping alerts collapse into the last state of their window with its flap count.
+    Events that are not alerts pass through unchanged.
+    """
+    kept = []
+    pending = OrderedDict()
+    for entry in sorted(normalized, key=lambda entry: entry[0]["timestamp"] if entry[0] else 0):
+        alert, media_event = entry[0], entry[1]
+        if alert is None:
+            kept.append(entry)
+            continue
+        keep, new_window = track_alert(alert)
+        if not keep:
+            continue
+        key = alert_key(alert)
+        if key[1] is None:
+            kept.append(entry)
+            continue
+        if new_window and key in pending:
+            kept.append(pending.pop(key))
+        if media_event and "flap_count" in alert:
+            media_event["flap_count"] = alert["flap_count"]
+        pending[key] = entry
+    return kept + list(pending.values())
+
+
+def normalize_event(event):
+    """
+    Apply the storage rules to an event. Returns the events table item of an alert (or None)
+    and the CloudWatch events table item (or None if the event has no resource ARN).
+    """
+    rule = event_rule(event["source"], event["detail-type"])
+    # dropped event types are rejected before any lookups
+    if rule["drop"]:
+        print("Dropping {} event from {}.".format(event["detail-type"], event["source"]))
+        return None, None
+    alert = None
+    event["timestamp"] = int(datetime.datetime.strptime(
+        event["time"], '%Y-%m-%dT%H:%M:%SZ').timestamp())
+    event["expires"] = event["timestamp"] + int(os.environ["ITEM_TTL"])
+    event["detail"]["time"] = event["time"]
+
+    resource_arn = rule["arn"](event)
+    if resource_arn:
+        event["resource_arn"] = resource_arn
+
+    # handle alerts
+    if rule["alert"]:
+        if rule["alert_fields"]:
+            rule["alert_fields"](event)
+        # the fields below are only for the CloudWatch events table
+        alert = dict(event)
+
+    # set the rest of the information needed for storing as regular CWE
+    # give timestamp a microsecond precision since it's sort key in CWE table
+    event["timestamp"] = sort_timestamp(event)
+    event["data"] = json.dumps(event["detail"])
+    event["type"] = event["detail-type"]
+    if "eventName" in event["detail"]:
+        event["type"] = event["type"] + ": " + event["detail"]["eventName"]
+
+    # handle specific cases depending on source
+    for transform in rule["transforms"]:
+        transform(event)
+
+    # if item has no resource arn, don't save in DB
+    if "resource_arn" in event:
+        if EVENT_BUCKETS == "day":
+            # spread each resource's events over one partition per day
+            event["resource_arn"] = "{}#{}".format(event["resource_arn"], time.strftime("%Y%m%d", time.gmtime(event["timestamp"] // SORT_KEY_SCALE)))
+        return alert, event
+    return alert, None
+
+
+def sort_timestamp(event):
+    """
+    Return the CloudWatch events sort key of an event: its time in microseconds with the digits below the second
+    taken from a hash of the event id, so a redelivered event keeps its key.
+    """
+    event_id = event["id"] if "id" in event else str(uuid.uuid4())
+    suffix = int(hashlib.sha1(event_id.encode("utf-8")).hexdigest(), 16)
+    return event["timestamp"] * SORT_KEY_SCALE + suffix % SORT_KEY_SCALE
+
+
+def event_rule(source, detail_type):
+    """
+    Return the rule for a (source, detail-type) pair, deriving and keeping one on first sight of an undeclared type.
+    """
+    key = (source, detail_type)
+    if key not in EVENT_RULES:
+        EVENT_RULES[key] = derived_rule(source, detail_type)
+    return EVENT_RULES[key]
+
+
+def declared_rule(detail_type, arn_paths, alert_fields=None, transforms=(), search=False):
+    """
+    Build the normalization rule of a known event type: whether it is dropped or stored as an alert with alert_fields,
+    the key paths of its resource ARN, whether the ARN search is the fallback when none resolves, and its transforms.
+    """
+    return {
+        "drop": detail_type in DROP_EVENT_TYPES,
+        "alert": alert_fields is not None,
+        "alert_fields": alert_fields,
+        "arn": arn_extractor(arn_paths, search),
+        "transforms": list(transforms)
+    }
+
+
+def derived_rule(source, detail_type):
+    """
+    Derive the normalization rule of an event type missing from EVENT_RULES from its source and detail-type,
+    with the ARN search as its resource ARN extractor.
+    """
+    alert_fields = None
+    if "MediaLive" in detail_type:
+        alert_fields = medialive_alert_fields
+    elif "MediaConnect" in detail_type:
+        alert_fields = mediaconnect_alert_fields
+    transforms = []
+    if source == "aws.medialive":
+        transforms.append(medialive_schedule_arn)
+    elif source == "aws.mediapackage":
+        transforms.append(harvest_job_arn)
+    elif source == "aws.mediastore" and "MediaStore Object State Change" in detail_type:
+        transforms.append(mediastore_container_arn)
+    return {
+        "drop": detail_type in DROP_EVENT_TYPES,
+        "alert": "Alert" in detail_type,
+        "alert_fields": alert_fields,
+        "arn": arn_extractor((), True),
+        "transforms": transforms
+    }
+
+
+def arn_extractor(arn_paths, search):
+    """
+    Return a function that reads the resource ARN of an event from the first present key path,
+    optionally falling back to searching the event for any form of ARN.
+    """
+    def extract(event):
+        for path in arn_paths:
+            value = event
+            for key in path:
+                if isinstance(value, dict):
+                    value = value.get(key)
+                elif isinstance(value, list) and isinstance(key, int) and key < len(value):
+                    value = value[key]
+                else:
+                    value = None
+            if value:
+                return unquote(value)
+        return searched_resource_arn(event) if search else None
+    return extract
+
+
+def searched_resource_arn(event):
+    """
+    Search an event for the various forms of ARN from the media services.
+    """
+    # remove arn that is for userIdentity or inputSecurityGroup
+    arns = [match.value for match in ARN_EXPRESSION.find(event)
+            if not ("user" in match.value or "role" in match.value or "inputSecurityGroup" in match.value)]
+    if arns:
+        return unquote(arns[0])
+    # for certain events, the ARN is not labeled as an ARN but instead put in the resources list
+    if event["resources"] and "vod" not in event["resources"][0]:
+        return event["resources"][0]
+    return None
+
+
+def medialive_alert_fields(event):
+    """
+    Map the fields of a MediaLive alert.
+    """
+    event["alarm_id"] = event["detail"]["alarm_id"]
+    event["alarm_state"] = event["detail"]["alarm_state"].lower()
+    event["detail"]["pipeline_state"] = get_pipeline_state(event)
+
+
+def mediaconnect_alert_fields(event):
+    """
+    Map the fields of a MediaConnect alert.
+    """
+    event["alarm_id"] = event["detail"]["error-id"]
+    if event["detail"]["errored"] == True:
+        event["alarm_state"] = "set"
+    else:
+        event["alarm_state"] = "cleared"
+    event["detail"]["alert_type"] = event["detail"].pop("error-code")
+    event["detail"]["message"] = event["detail"].pop("error-message")
+
+
+def medialive_schedule_arn(event):
+    """
+    Create the channel ARN of a BatchUpdateSchedule event.
+    """
+    if "BatchUpdateSchedule" in event["type"]:
+        print("Creating an ARN for BatchUpdateSchedule event.")
+        event["resource_arn"] = "arn:aws:medialive:" + event['region'] + ":" + \
+            event['account'] + ":channel:" + \
+            event['detail']['requestParameters']['channelId']
+
+
+def harvest_job_arn(event):
+    """
+    Replace the HarvestJob ARN of a HarvestJob event with the ARN of its origin endpoint.
+    """
+    if "HarvestJob" in event["type"]:
+        print("Resolving the ARN of endpoint in a HarvestJob event.")
+        # the ARN available through resources is the HarvestJob ARN, not the endpoint
+        orig_id = [match.value for match in ORIGIN_ENDPOINT_ID_EXPRESSION.find(event)]
+        if orig_id:
+            event["resource_arn"] = origin_endpoint_arn(event["region"], orig_id[0])
+        else:
+            print("Skipping this event. Origin ID not present in the HarvestJob event." + event["type"])
+
+
+def mediastore_container_arn(event):
+    """
+    For object state changes the resource is the object, not the container, so the captured ARN needs to be fixed.
+    """
+    if "resource_arn" in event:
+        temp_arn = event["resource_arn"].split('/')
+        event["resource_arn"] = temp_arn[0] + "/" + temp_arn[1]
+
+
+# resource ARN key paths of the known event shapes
+CHANNEL_ARN = ("detail", "channel_arn")
+MULTIPLEX_ARN = ("detail", "multiplex_arn")
+FLOW_ARN = ("detail", "resource-arn")
+HARVEST_JOB_ARN = ("detail", "harvest_job", "arn")
+PLAYBACK_CONFIGURATION_ARN = ("detail", "responseElements", "PlaybackConfigurationArn")
+FIRST_RESOURCE = ("resources", 0)
+CLOUDTRAIL = "AWS API Call via CloudTrail"
+
+# normalization rules by (source, detail-type), event types not listed here are derived on first sight
+# CloudTrail calls vary in shape by API, so their rules keep the ARN search as the fallback
+EVENT_RULES = {
+    ("aws.medialive", "MediaLive Channel Alert"): declared_rule("MediaLive Channel Alert", [CHANNEL_ARN], alert_fields=medialive_alert_fields),
+    ("aws.medialive", "MediaLive Channel State Change"): declared_rule("MediaLive Channel State Change", [CHANNEL_ARN]),
+    ("aws.medialive", "MediaLive Channel Input Change"): declared_rule("MediaLive Channel Input Change", [CHANNEL_ARN]),
+    ("aws.medialive", "MediaLive Multiplex Alert"): declared_rule("MediaLive Multiplex Alert", [MULTIPLEX_ARN], alert_fields=medialive_alert_fields),
+    ("aws.medialive", "MediaLive Multiplex State Change"): declared_rule("MediaLive Multiplex State Change", [MULTIPLEX_ARN]),
+    ("aws.medialive", CLOUDTRAIL): declared_rule(CLOUDTRAIL, [], transforms=[medialive_schedule_arn], search=True),
+    ("aws.mediaconnect", "MediaConnect Alert"): declared_rule("MediaConnect Alert", [FLOW_ARN, FIRST_RESOURCE], alert_fields=mediaconnect_alert_fields),
+    ("aws.mediaconnect", "MediaConnect Flow Status Change"): declared_rule("MediaConnect Flow Status Change", [FLOW_ARN, FIRST_RESOURCE]),
+    ("aws.mediaconnect", CLOUDTRAIL): declared_rule(CLOUDTRAIL, [], search=True),
+    ("aws.mediapackage", "MediaPackage HarvestJob Notification"): declared_rule("MediaPackage HarvestJob Notification", [HARVEST_JOB_ARN], transforms=[harvest_job_arn]),
+    ("aws.mediapackage", "MediaPackage Input Notification"): declared_rule("MediaPackage Input Notification", [FIRST_RESOURCE]),
+    ("aws.mediapackage", "MediaPackage Key Provider Notification"): declared_rule("MediaPackage Key Provider Notification", [FIRST_RESOURCE]),
+    ("aws.mediapackage", CLOUDTRAIL): declared_rule(CLOUDTRAIL, [], transforms=[harvest_job_arn], search=True),
+    ("aws.mediastore", "MediaStore Object State Change"): declared_rule("MediaStore Object State Change", [FIRST_RESOURCE], transforms=[mediastore_container_arn]),
+    ("aws.mediastore", "MediaStore Container State Change"): declared_rule("MediaStore Container State Change", [FIRST_RESOURCE]),
+    ("aws.mediastore", CLOUDTRAIL): declared_rule(CLOUDTRAIL, [], search=True),
+    ("aws.mediatailor", CLOUDTRAIL): declared_rule(CLOUDTRAIL, [PLAYBACK_CONFIGURATION_ARN], search=True)
+}
+
+
 def get_pipeline_state(event):
     """
     Check for pipeline state only if source is aws.medialive
@@ -137,20 +505,81 @@ def get_pipeline_state(event):
     resource_arn = event["resource_arn"]
     try:
         if event["source"] == "aws.medialive" and event["detail"]["alarm_state"] == "SET":
-            resource = boto3.resource('dynamodb', region_name=DYNAMO_REGION_NAME)
-            CONTENT_TABLE = resource.Table(CONTENT_TABLE_NAME)
-            response = CONTENT_TABLE.query(KeyConditionExpression=Key('arn').eq(resource_arn))
-            if "Items" in response:
-                item = response["Items"][0]
-                if "service" in item and item["service"] == "medialive-multiplex":
-                    running_pipeline = bool(False)
-                else:
-                    data = json.loads(item["data"])
-                    if "ChannelClass" in data and data["ChannelClass"] == "STANDARD":
-                        running_pipeline = bool(False)
+            service, channel_class = channel_class_lookup(resource_arn)
+            if service == "medialive-multiplex" or channel_class == "STANDARD":
+                running_pipeline = bool(False)
     except ClientError as error:
         print(error)
     if "pipeline" in event["detail"]:
         log_msg = 'Pipeline {} state to for {} is {}'
         print(log_msg.format(event["detail"]["pipeline"], resource_arn, running_pipeline))
     return running_pipeline
+
+
+def channel_class_lookup(resource_arn):
+    """
+    Return the cached service and channel class of a resource, reading the content table on a miss.
+    """
+    now = time.time()
+    cached = CHANNEL_CLASS_CACHE.get(resource_arn)
+    if cached and cached[2] > now:
+        CHANNEL_CLASS_CACHE.move_to_end(resource_arn)
+        return cached[0], cached[1]
+    service = None
+    channel_class = None
+    # the cache stores the channel class at the top level, older items only have it in data
+    response = CONTENT_TABLE.get_item(Key={"arn": resource_arn}, ProjectionExpression="#service, channel_class",
+                                      ExpressionAttributeNames={"#service": "service"})
+    if "Item" in response:
+        service = response["Item"].get("service")
+        channel_class = response["Item"].get("channel_class")
+        if channel_class is None and service == "medialive-channel":
+            response = CONTENT_TABLE.get_item(Key={"arn": resource_arn}, ProjectionExpression="#data", ExpressionAttributeNames={"#data": "data"})
+            channel_class = json.loads(response.get("Item", {}).get("data", "{}")).get("ChannelClass")
+    CHANNEL_CLASS_CACHE[resource_arn] = (service, channel_class, now + CHANNEL_CLASS_CACHE_SECONDS)
+    CHANNEL_CLASS_CACHE.move_to_end(resource_arn)
+    while len(CHANNEL_CLASS_CACHE) > CHANNEL_CLASS_CACHE_SIZE:
+        CHANNEL_CLASS_CACHE.popitem(last=False)
+    return service, channel_class
+
+
+def origin_endpoint_arn(region, endpoint_id):
+    """
+    Resolve a MediaPackage origin endpoint id to its ARN from the in-process cache,
+    then the cached endpoints of the region in the content table, and only then MediaPackage.
+    """
+    key = (region, endpoint_id)
+    if key not in ENDPOINT_ARN_CACHE and ENDPOINT_REGIONS_LOADED.get(region, 0) < time.time():
+        ENDPOINT_REGIONS_LOADED[region] = time.time() + ENDPOINT_REGION_RELOAD_SECONDS
+        arguments = {
+            "IndexName": "ServiceRegionIndex",
+            "KeyConditionExpression": Key("service").eq("mediapackage-origin-endpoint") & Key("region").eq(region),
+            "ProjectionExpression": "arn, endpoint_id"
+        }
+        response = CONTENT_TABLE.query(**arguments)
+        items = response["Items"]
+        while "LastEvaluatedKey" in response:
+            response = CONTENT_TABLE.query(ExclusiveStartKey=response["LastEvaluatedKey"], **arguments)
+            items = items + response["Items"]
+        for item in items:
+            if "endpoint_id" in item:
+                remember_endpoint_arn((region, item["endpoint_id"]), item["arn"])
+    if key in ENDPOINT_ARN_CACHE:
+        ENDPOINT_ARN_CACHE.move_to_end(key)
+        return ENDPOINT_ARN_CACHE[key]
+    print("Asking MediaPackage for the ARN of endpoint {}.".format(endpoint_id))
+    if region not in MEDIAPACKAGE_CLIENTS:
+        MEDIAPACKAGE_CLIENTS[region] = boto3.client('mediapackage', region_name=region, config=MSAM_BOTO3_CONFIG)
+    response = MEDIAPACKAGE_CLIENTS[region].describe_origin_endpoint(Id=endpoint_id)
+    remember_endpoint_arn(key, response["Arn"])
+    return response["Arn"]
+
+
+def remember_endpoint_arn(key, arn):
+    """
+    Add an endpoint ARN to the least recently used cache, evicting the oldest entries over the limit.
+    """
+    ENDPOINT_ARN_CACHE[key] = arn
+    ENDPOINT_ARN_CACHE.move_to_end(key)
+    while len(ENDPOINT_ARN_CACHE) > ENDPOINT_ARN_CACHE_SIZE:
+        ENDPOINT_ARN_CACHE.popitem(last=False)
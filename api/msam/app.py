@@ -8,7 +8,7 @@ import os
 import time
 
 import boto3
-from chalice import Chalice, Rate
+from chalice import BadRequestError, Chalice, Rate, Response
 
 from chalicelib import cache
 import chalicelib.channels as channel_tiles
@@ -28,6 +28,12 @@ SSM_NODE_UPDATE_RATE_MINUTES = 5
 # update connections at this interval
 CONNECTION_UPDATE_RATE_MINUTES = 5
 
+# refresh the cached alarm catalog of each region at this interval
+ALARM_CATALOG_UPDATE_RATE_MINUTES = 5
+
+# reconcile subscribed alarm state, the subscribed alarm registry and the per-state counts at this interval
+ALARM_RECONCILE_RATE_MINUTES = 15
+
 # update MSAM visuals from tags at this interval
 TAG_UPDATE_RATE_MINUTES = 5
 
@@ -183,9 +189,16 @@ def regions():
 @app.route('/cloudwatch/alarms/all/{region}', cors=True, api_key_required=True, methods=['GET'])
 def get_cloudwatch_alarms_region(region):
     """
-    API entry point to retrieve all CloudWatch alarms for a given region.
+    API entry point to retrieve all CloudWatch alarms for a given region from the cached alarm catalog.
     """
-    return cloudwatch_data.get_cloudwatch_alarms_region(region)
+    catalog = cloudwatch_data.alarm_catalog(region)
+    if not catalog["etag"]:
+        return catalog["alarms"]
+    # browsers revalidate with the ETag and get an empty 304 when nothing changed
+    headers = {"Cache-Control": "no-cache", "ETag": catalog["etag"]}
+    if app.current_request.headers.get("if-none-match") == catalog["etag"]:
+        return Response(body="", status_code=304, headers=headers)
+    return Response(body=catalog["alarms"], headers=headers)
 
 
 @app.lambda_function()
@@ -212,6 +225,22 @@ def unsubscribe_resource_from_alarm(alarm_name, region):
     return cloudwatch_data.unsubscribe_resource_from_alarm(app.current_request, alarm_name, region)
 
 
+@app.route('/cloudwatch/alarms/subscribe', cors=True, api_key_required=True, methods=['PUT', 'POST'])
+def subscribe_alarms_bulk():
+    """
+    API entry point to subscribe many nodes to many CloudWatch alarms in one request.
+    """
+    return cloudwatch_data.subscribe_alarms_bulk(app.current_request)
+
+
+@app.route('/cloudwatch/alarms/unsubscribe', cors=True, api_key_required=True, methods=['PUT', 'POST'])
+def unsubscribe_alarms_bulk():
+    """
+    API entry point to unsubscribe many nodes from many CloudWatch alarms in one request.
+    """
+    return cloudwatch_data.unsubscribe_alarms_bulk(app.current_request)
+
+
 @app.route('/cloudwatch/alarm/{alarm_name}/region/{region}/subscribers', cors=True, api_key_required=True, methods=['GET'])
 def subscribers_to_alarm(alarm_name, region):
     """
@@ -225,7 +254,12 @@ def subscribed_with_state(alarm_state):
     """
     API entry point to return nodes subscribed to alarms in a given alarm state (OK, ALARM, INSUFFICIENT_DATA).
     """
-    return cloudwatch_data.subscribed_with_state(alarm_state)
+    view = cloudwatch_data.alarm_state_view(alarm_state)
+    # the ETag carries the counts' version so polling clients get an empty 304 when nothing changed
+    headers = {"Cache-Control": "no-cache", "ETag": view["etag"]}
+    if app.current_request.headers.get("if-none-match") == view["etag"]:
+        return Response(body="", status_code=304, headers=headers)
+    return Response(body=view["subscribers"], headers=headers)
 
 
 @app.route('/cloudwatch/alarms/subscriber/{resource_arn}', cors=True, api_key_required=True, methods=['GET'])
@@ -257,7 +291,16 @@ def get_cloudwatch_events_state_source(state, source):
     """
     API entry point to retrieve all alert events in a given state (set, clear) from a specific source.
     """
-    return cloudwatch_data.get_cloudwatch_events_state(state)
+    return cloudwatch_data.get_cloudwatch_events_state_source(state, source)
+
+
+@app.route('/cloudwatch/events/state/{state}/page', cors=True, api_key_required=True, methods=['GET'])
+def get_cloudwatch_events_state_page(state):
+    """
+    API entry point to retrieve one page of alert events in a given state (set, clear). Accepts source, limit and cursor query parameters.
+    """
+    params = app.current_request.query_params or {}
+    return cloudwatch_data.get_cloudwatch_events_state_page(state, params.get("source"), params.get("limit", cloudwatch_data.EVENTS_PAGE_LIMIT), params.get("cursor"))
 
 
 @app.route('/cloudwatch/events/state/{state}/groups', cors=True, api_key_required=True, methods=['GET'])
@@ -276,6 +319,22 @@ def get_cloudwatch_events_resource(resource_arn):
     return cloudwatch_data.get_cloudwatch_events_resource(resource_arn)
 
 
+@app.route('/cloudwatch/events/rollup/{resource_arn}', cors=True, api_key_required=True, methods=['GET'])
+def get_cloudwatch_event_rollups(resource_arn):
+    """
+    API entry point to return the CloudWatch event counts of a node per interval by event type and alert state.
+    Accepts start_time and end_time (milliseconds) and interval (seconds) query parameters.
+    """
+    params = app.current_request.query_params or {}
+    try:
+        start_time = int(params.get("start_time", 0))
+        end_time = int(params.get("end_time", 0))
+        interval = int(params.get("interval", cloudwatch_data.CLOUDWATCH_EVENTS_ROLLUP_DEFAULT_INTERVAL))
+    except ValueError as error:
+        raise BadRequestError("start_time, end_time and interval must be integers") from error
+    return cloudwatch_data.get_cloudwatch_event_rollups(resource_arn, start_time, end_time, interval)
+
+
 @app.route('/cloudwatch/events/{resource_arn}/{start_time}', cors=True, api_key_required=True, methods=['GET'])
 def get_cloudwatch_events_resource(resource_arn, start_time):
     """
@@ -329,6 +388,22 @@ def update_connections(_):
     return periodic_handlers.update_connections()
 
 
+@app.schedule(Rate(ALARM_CATALOG_UPDATE_RATE_MINUTES, unit=Rate.MINUTES))
+def update_alarm_catalogs(_):
+    """
+    Entry point for the CloudWatch scheduled task to refresh the cached alarm catalog of each region.
+    """
+    return periodic_handlers.update_alarm_catalogs()
+
+
+@app.schedule(Rate(ALARM_RECONCILE_RATE_MINUTES, unit=Rate.MINUTES))
+def reconcile_alarms(_):
+    """
+    Entry point for the CloudWatch scheduled task to correct drift in subscribed alarm state and the materialized alarm views.
+    """
+    return periodic_handlers.update_alarms()
+
+
 @app.schedule(Rate(TAG_UPDATE_RATE_MINUTES, unit=Rate.MINUTES))
 def update_from_tags(_):
     """
@@ -29,6 +29,9 @@ ENV_VARS = {
     "CLOUDWATCH_EVENTS_TABLE_NAME": {
         "Ref": "CloudWatchEventsTableName"
     },
+    "CLOUDWATCH_EVENTS_BUCKETS": {
+        "Ref": "CloudWatchEventsBuckets"
+    },
     "LAYOUT_TABLE_NAME": {
         "Ref": "LayoutTableName"
     },
@@ -87,6 +90,12 @@ PARAMETERS = {
         "MinLength": 1,
         "ConstraintDescription": "Please enter a value for this field."
     },
+    "CloudWatchEventsBuckets": {
+        "Default": "none",
+        "Description": "Partition CloudWatch events by resource and day (day) or by resource only (none). Must match the event collector setting.",
+        "Type": "String",
+        "AllowedValues": ["none", "day"]
+    },
     "CacheItemTTL": {
         "Default": "7200",
         "Description": "This is the maximum time in seconds a cached item will remain if never updated.",
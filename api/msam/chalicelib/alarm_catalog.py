@@ -0,0 +1,32 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""
+This file contains helper functions for the cached CloudWatch alarm catalog in the content table.
+It is shared with the alarm state collector in api/events, so it must not import other chalicelib modules.
+"""
+
+import json
+import time
+
+# cached CloudWatch alarm catalogs are stored in the content table under this service name
+ALARM_CATALOG_SERVICE = "cloudwatch-alarm"
+
+
+def update_catalog_state(table, alarm_arn, state, state_updated):
+    """
+    Apply an alarm state change to the alarm's item in the cached alarm catalog, if the catalog has one.
+    Returns True if the item was rewritten. Errors are raised to the caller.
+    """
+    response = table.get_item(Key={"arn": alarm_arn})
+    if "Item" not in response:
+        return False
+    item = response["Item"]
+    alarm = json.loads(item["data"])
+    if alarm["StateValue"] == state and alarm["StateUpdated"] == state_updated:
+        return False
+    alarm["StateValue"] = state
+    alarm["StateUpdated"] = state_updated
+    item["data"] = json.dumps(alarm, sort_keys=True)
+    item["updated"] = int(time.time())
+    table.put_item(Item=item)
+    return True
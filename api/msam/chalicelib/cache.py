@@ -4,6 +4,7 @@
 This file contains helper functions for updating and querying the cache.
 """
 
+import json
 import os
 from urllib.parse import unquote
 
@@ -12,6 +13,8 @@ from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 from botocore.config import Config
 
+from chalicelib import content
+
 # table names generated by CloudFormation
 CONTENT_TABLE_NAME = os.environ["CONTENT_TABLE_NAME"]
 
@@ -101,6 +104,9 @@ def put_cached_data(request):
             # workaround for dynamodb numeric types
             entry["expires"] = int(entry["expires"])
             entry["updated"] = int(entry["updated"])
+            # project MSAM tags to top-level attributes for the tagged index
+            if isinstance(entry.get("data"), str):
+                entry.update(content.tag_attributes(json.loads(entry["data"])))
             ddb_table.put_item(Item=entry)
         return {"message": "saved"}
     except ClientError as error:
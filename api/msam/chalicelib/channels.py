@@ -77,10 +77,11 @@ def set_channel_nodes(name, node_ids):
         table = DYNAMO_RESOURCE.Table(CHANNELS_TABLE_NAME)
         # print(request.json_body)
         # node_ids = request.json_body
-        # write the channel nodes to the database
-        for node_id in node_ids:
-            item = {"channel": name, "id": node_id}
-            table.put_item(Item=item)
+        # write the channel nodes to the database in batch
+        with table.batch_writer(overwrite_by_pkeys=["channel", "id"]) as batch:
+            for node_id in node_ids:
+                item = {"channel": name, "id": node_id}
+                batch.put_item(Item=item)
         # update the list of channels in settings
         name_list = msam_settings.get_setting("channels")
         if not name_list:
@@ -4,95 +4,207 @@
 This file contains helper functions related to CloudWatch alarms.
 """
 
+import base64
+import binascii
 import datetime
+import hashlib
+import heapq
 import json
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import unquote
 
 import boto3
 from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 from botocore.config import Config
-from jsonpath_ng import parse
+
+from chalicelib import alarm_catalog as catalog_items
+from chalicelib import counter_maps
+from chalicelib import dynamodb
+from chalicelib import extractors
+from chalicelib import settings as msam_settings
 
 # table names generated by CloudFormation
 ALARMS_TABLE_NAME = os.environ["ALARMS_TABLE_NAME"]
 EVENTS_TABLE_NAME = os.environ["EVENTS_TABLE_NAME"]
 CLOUDWATCH_EVENTS_TABLE_NAME = os.environ["CLOUDWATCH_EVENTS_TABLE_NAME"]
+CONTENT_TABLE_NAME = os.environ["CONTENT_TABLE_NAME"]
+
+# TTL provided via CloudFormation
+CACHE_ITEM_TTL = int(os.environ["CACHE_ITEM_TTL"])
 
 # user-agent config
 STAMP = os.environ["BUILD_STAMP"]
 MSAM_BOTO3_CONFIG = Config(user_agent="aws-media-services-applications-mapper/{stamp}/cloudwatch.py".format(stamp=STAMP))
 
+# DescribeAlarms accepts up to this many alarm names per call
+DESCRIBE_ALARMS_MAX_NAMES = 100
+
+# largest page returned by the paged events endpoint
+EVENTS_PAGE_LIMIT = 500
+
+# event attributes read for pipeline grouping, enough for the browser's alert views
+GROUP_EVENT_ATTRIBUTES = ["resource_arn", "alarm_id", "alarm_state", "source", "region", "detail"]
+
+# cached CloudWatch alarm catalogs are stored in the content table under this service name
+ALARM_CATALOG_SERVICE = catalog_items.ALARM_CATALOG_SERVICE
+
+# seconds a region's alarm catalog is served from memory before the content table is read again
+ALARM_CATALOG_CACHE_SECONDS = 60
+ALARM_CATALOG_CACHE = {}
+
+# settings key with the time a region's refreshed alarm catalog was found empty, an empty region has no catalog items
+ALARM_CATALOG_EMPTY_KEY = "alarm-catalog-empty-{}"
+# seconds an empty catalog is trusted before the region is described again, the catalog refresh rate
+ALARM_CATALOG_EMPTY_SECONDS = 300
+
+# settings key with the last time a region's alarm catalog was read, recorded at most once per interval by each container
+ALARM_CATALOG_READ_KEY = "alarm-catalog-read-{}"
+ALARM_CATALOG_READ_RECORD_SECONDS = 300
+ALARM_CATALOG_RECORDED_READS = {}
+# regions are refreshed while they have subscribed alarms or were read within this many seconds
+ALARM_CATALOG_READ_SECONDS = 3600
+
+# unchanged alarm rows are rewritten only when their Updated heartbeat is older than this
+ALARM_HEARTBEAT_SECONDS = 3600
+
+# settings key of the distinct subscribed alarms: {"region:alarm name": subscriber count}
+SUBSCRIBED_ALARMS_KEY = "subscribed-alarms"
+
+# counter maps are split by member hash across this many settings items ("<key>#<shard>")
+COUNTER_MAP_SHARDS = counter_maps.COUNTER_MAP_SHARDS
+
+# counter map of each state's subscriber alarm counts: {resource ARN: alarm count}, also kept by the alarm state collector
+ALARM_STATE_COUNTS_KEY = counter_maps.ALARM_STATE_COUNTS_KEY
+ALARM_STATES = ["OK", "ALARM", "INSUFFICIENT_DATA"]
+
+# optional time bucketing of the CloudWatch events partition key ("none" or "day"), must match the event collector
+CLOUDWATCH_EVENTS_BUCKETS = os.environ.get("CLOUDWATCH_EVENTS_BUCKETS", "none")
+# days of buckets read when no start time is given, the collector's default item TTL
+CLOUDWATCH_EVENTS_LOOKBACK_DAYS = 7
+# number of bucket queries in flight at once
+CLOUDWATCH_EVENTS_QUERY_WORKERS = 8
+MILLISECONDS_PER_DAY = 86400000
+# CloudWatch events sort keys are in microseconds, must match the event collector
+# items stored before then have millisecond keys, below this bound, until they expire
+CLOUDWATCH_EVENTS_KEY_SCALE = 1000
+CLOUDWATCH_EVENTS_MILLISECOND_KEYS = 10 ** 14
+
+# per-resource event counts kept by the event collector under this partition key, one item per interval, must match the event collector
+CLOUDWATCH_EVENTS_ROLLUP_PARTITION = "{}#rollup"
+CLOUDWATCH_EVENTS_ROLLUP_SECONDS = 300
+# interval of the rollup endpoint when none is requested
+CLOUDWATCH_EVENTS_ROLLUP_DEFAULT_INTERVAL = 3600
+
+
+def alarm_records(region_name, alarm, subscriber_arns, updated):
+    """
+    Build the alarms table items for a single alarm's subscribers.
+    """
+    region_alarm_name = "{}:{}".format(region_name, alarm["AlarmName"])
+    if 'Namespace' in alarm:
+        namespace = alarm['Namespace']
+    else:
+        namespace = "n/a"
+    items = []
+    for resource_arn in subscriber_arns:
+        items.append({
+            "RegionAlarmName": region_alarm_name,
+            "ResourceArn": resource_arn,
+            "StateValue": alarm['StateValue'],
+            "Namespace": namespace,
+            "StateUpdated": int(alarm['StateUpdatedTimestamp'].timestamp()),
+            "Updated": updated
+        })
+    return items
+
+
+def alarm_state_changed(item, stored):
+    """
+    Check a new alarm item against the stored row, True if the state changed or the stored heartbeat is stale.
+    """
+    if not stored:
+        return True
+    if stored.get("StateValue") != item["StateValue"] or stored.get("StateUpdated") != item["StateUpdated"]:
+        return True
+    return item["Updated"] - int(stored.get("Updated", 0)) >= ALARM_HEARTBEAT_SECONDS
 
-def update_alarm_records(region_name, alarm, subscriber_arns):
+
+def put_alarm_records(items, ddb_resource=None):
     """
-    Update a single alarm's status in the table.
+    Write alarm items to the table in batches.
     """
     try:
-        ddb_table_name = ALARMS_TABLE_NAME
-        ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
-        ddb_table = ddb_resource.Table(ddb_table_name)
-        region_alarm_name = "{}:{}".format(region_name, alarm["AlarmName"])
-        if 'Namespace' in alarm:
-            namespace = alarm['Namespace']
-        else:
-            namespace = "n/a"
-        updated = int(time.time())
-        for resource_arn in subscriber_arns:
-            item = {
-                "RegionAlarmName": region_alarm_name,
-                "ResourceArn": resource_arn,
-                "StateValue": alarm['StateValue'],
-                "Namespace": namespace,
-                "StateUpdated": int(alarm['StateUpdatedTimestamp'].timestamp()),
-                "Updated": updated
-            }
-            ddb_table.put_item(Item=item)
+        if ddb_resource is None:
+            ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
+        ddb_table = ddb_resource.Table(ALARMS_TABLE_NAME)
+        with ddb_table.batch_writer(overwrite_by_pkeys=["RegionAlarmName", "ResourceArn"]) as batch:
+            for item in items:
+                batch.put_item(Item=item)
     except ClientError as error:
         print(error)
 
 
-def update_alarm_subscriber(region_name, alarm_name, subscriber_arn):
+def update_alarms(region_name, alarm_subscribers):
     """
-    Update a single subscriber's alarm status in the alarms table.
+    Update the status of subscribed alarms in the alarms table for a given region.
+    The alarm_subscribers argument maps each alarm name to its subscriber ARNs and their stored rows.
+    Only rows with a changed state or a stale heartbeat are written.
     """
     try:
-        print(f"update subscriber {subscriber_arn} alarm {alarm_name} in region {region_name}")
-        cloudwatch = boto3.client('cloudwatch', region_name=region_name, config=MSAM_BOTO3_CONFIG)
-        response = cloudwatch.describe_alarms(AlarmNames=[alarm_name])
-        alarms = response['CompositeAlarms'] + response['MetricAlarms']
-        for alarm in alarms:
-            update_alarm_records(region_name, alarm, [subscriber_arn])
+        alarm_names = sorted(alarm_subscribers)
+        print(f"update {len(alarm_names)} alarms in region {region_name}")
+        # separate session so regions can be updated from concurrent threads
+        session = boto3.session.Session()
+        cloudwatch = session.client('cloudwatch', region_name=region_name, config=MSAM_BOTO3_CONFIG)
+        updated = int(time.time())
+        items = []
+        for index in range(0, len(alarm_names), DESCRIBE_ALARMS_MAX_NAMES):
+            chunk = alarm_names[index:index + DESCRIBE_ALARMS_MAX_NAMES]
+            response = cloudwatch.describe_alarms(AlarmNames=chunk)
+            alarms = response['CompositeAlarms'] + response['MetricAlarms']
+            while "NextToken" in response:
+                response = cloudwatch.describe_alarms(AlarmNames=chunk, NextToken=response["NextToken"])
+                alarms = alarms + response['CompositeAlarms'] + response['MetricAlarms']
+            for alarm in alarms:
+                subscribers = alarm_subscribers.get(alarm["AlarmName"], {})
+                records = alarm_records(region_name, alarm, subscribers, updated)
+                items = items + [item for item in records if alarm_state_changed(item, subscribers[item["ResourceArn"]])]
+        print(f"{len(items)} alarm rows changed in region {region_name}")
+        if items:
+            ddb_resource = session.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
+            put_alarm_records(items, ddb_resource)
+            transitions = []
+            for item in items:
+                stored = alarm_subscribers[item["RegionAlarmName"].split(':', maxsplit=1)[1]][item["ResourceArn"]]
+                transitions.append((item["ResourceArn"], stored.get("StateValue"), item["StateValue"]))
+            change_alarm_state_counts(transitions, ddb_resource)
     except ClientError as error:
         print(error)
 
 
-def update_alarms(region_name, alarm_names):
+def subscribed_alarm_map():
     """
-    Update a list of alarms' status in the alarms table for a given region.
+    Read the alarms table once and group the subscribers of every alarm by region: {region: {alarm name: {subscriber ARN: stored row}}}.
     """
+    alarm_map = {}
     try:
-        print(f"update alarms {alarm_names} in region {region_name}")
-        cloudwatch = boto3.client('cloudwatch', region_name=region_name, config=MSAM_BOTO3_CONFIG)
-        response = cloudwatch.describe_alarms(AlarmNames=alarm_names)
-        alarms = response['CompositeAlarms'] + response['MetricAlarms']
-        for alarm in alarms:
-            print(f"alarm {alarm['AlarmName']}")
-            subscribers = subscribers_to_alarm(alarm["AlarmName"], region_name)
-            print(f"subscribers {subscribers}")
-            update_alarm_records(region_name, alarm, subscribers)
-        while "NextToken" in response:
-            response = cloudwatch.describe_alarms(AlarmNames=alarm_names, NextToken=response["NextToken"])
-            alarms = response['CompositeAlarms'] + response['MetricAlarms']
-            for alarm in alarms:
-                print(f"alarm {alarm['AlarmName']}")
-                subscribers = subscribers_to_alarm(alarm["AlarmName"], region_name)
-                print(f"subscribers {subscribers}")
-                update_alarm_records(region_name, alarm, subscribers)
+        ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
+        ddb_table = ddb_resource.Table(ALARMS_TABLE_NAME)
+        projection = "RegionAlarmName, ResourceArn, StateValue, StateUpdated, Updated"
+        response = ddb_table.scan(ProjectionExpression=projection)
+        scanned_items = response["Items"]
+        while "LastEvaluatedKey" in response:
+            response = ddb_table.scan(ProjectionExpression=projection, ExclusiveStartKey=response['LastEvaluatedKey'])
+            scanned_items = scanned_items + response["Items"]
+        for item in scanned_items:
+            region, name = item["RegionAlarmName"].split(':', maxsplit=1)
+            alarm_map.setdefault(region, {}).setdefault(name, {})[item["ResourceArn"]] = item
     except ClientError as error:
         print(error)
+    return alarm_map
 
 
 def alarms_for_subscriber(resource_arn):
@@ -133,101 +245,346 @@ def all_subscribed_alarms():
     """
     API entry point to return a unique list of all subscribed alarms in the database.
     """
-    split_items = []
+    registry = None
     try:
-        scanned_items = []
-        ddb_table_name = ALARMS_TABLE_NAME
-        ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
-        ddb_table = ddb_resource.Table(ddb_table_name)
-        response = ddb_table.scan(ProjectionExpression="RegionAlarmName")
-        if "Items" in response:
-            scanned_items = response["Items"]
-        while "LastEvaluatedKey" in response:
-            response = ddb_table.scan(ProjectionExpression="RegionAlarmName", ExclusiveStartKey=response['LastEvaluatedKey'])
-            if "Items" in response:
-                scanned_items = scanned_items + response["Items"]
-        for item in scanned_items:
-            split_attr = item["RegionAlarmName"].split(':', maxsplit=1)
-            region = split_attr[0]
-            name = split_attr[1]
-            alarm = {"Region": region, "AlarmName": name}
-            split_items.append(alarm)
+        registry = read_counter_map(SUBSCRIBED_ALARMS_KEY)[0]
     except ClientError as error:
         print(error)
-    return [dict(t) for t in {tuple(d.items()) for d in split_items}]
+    if registry is None:
+        # first read after an upgrade, build the registry from the alarms table
+        registry = reconcile_subscribed_alarms(subscribed_alarm_map())
+    alarms = []
+    for region_alarm_name in sorted(registry):
+        region, name = region_alarm_name.split(':', maxsplit=1)
+        alarms.append({"Region": region, "AlarmName": name})
+    return alarms
+
+
+def reconcile_subscribed_alarms(alarm_map):
+    """
+    Rewrite the subscribed alarm registry from a subscribed_alarm_map() result where the stored counts have drifted.
+    """
+    registry = {}
+    for region, alarms in alarm_map.items():
+        for name, subscribers in alarms.items():
+            registry["{}:{}".format(region, name)] = len(subscribers)
+    try:
+        write_counter_map(SUBSCRIBED_ALARMS_KEY, registry)
+    except ClientError as error:
+        print(error)
+    return registry
+
+
+def change_alarm_subscribers(deltas):
+    """
+    Adjust the subscriber counts of alarms in the registry with {"region:alarm name": delta}, removing alarms without subscribers.
+    """
+    try:
+        if not change_counter_map(SUBSCRIBED_ALARMS_KEY, deltas) and any(delta > 0 for delta in deltas.values()):
+            # no registry yet, build it from the alarms table which already holds this change
+            reconcile_subscribed_alarms(subscribed_alarm_map())
+    except ClientError as error:
+        print(error)
+
+
+def counter_map_shards(key, ddb_resource):
+    """
+    Read the stored shards of a counter map: {settings key: item}.
+    """
+    keys = [{"id": "{}#{}".format(key, shard)} for shard in range(COUNTER_MAP_SHARDS)]
+    items = dynamodb.batch_get_items(ddb_resource, msam_settings.SETTINGS_TABLE_NAME, keys)
+    return {item["id"]: item for item in items}
+
+
+def read_counter_map(key, ddb_resource=None):
+    """
+    Read a counter map from its settings shards. Returns the members with a positive count and the sum of the shard versions,
+    or (None, 0) if the map has not been built. Errors are raised to the caller.
+    """
+    if ddb_resource is None:
+        ddb_resource = msam_settings.DYNAMO_RESOURCE
+    shards = counter_map_shards(key, ddb_resource)
+    if len(shards) < COUNTER_MAP_SHARDS:
+        return None, 0
+    counts = {}
+    for item in shards.values():
+        counts.update({member: int(count) for member, count in item["value"].items() if count > 0})
+    return counts, sum(int(item.get("version", 0)) for item in shards.values())
+
+
+def write_counter_map(key, counts, ddb_resource=None):
+    """
+    Bring the settings shards of a counter map to counts by adding the difference of each member that differs,
+    so changes made concurrently by other writers are kept. Missing shards are created.
+    Returns the sum of the shard versions. Errors are raised to the caller.
+    """
+    if ddb_resource is None:
+        ddb_resource = msam_settings.DYNAMO_RESOURCE
+    table = ddb_resource.Table(msam_settings.SETTINGS_TABLE_NAME)
+    shards = counter_map_shards(key, ddb_resource)
+    expected = {"{}#{}".format(key, shard): {} for shard in range(COUNTER_MAP_SHARDS)}
+    for member, count in counts.items():
+        if count > 0:
+            expected[counter_maps.counter_shard_key(key, member)][member] = count
+    version = 0
+    rewritten = 0
+    for shard_key, shard_counts in expected.items():
+        if shard_key not in shards:
+            try:
+                table.put_item(Item={"id": shard_key, "value": shard_counts, "version": 1}, ConditionExpression="attribute_not_exists(id)")
+                version = version + 1
+                rewritten = rewritten + 1
+                continue
+            except ClientError as error:
+                if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+                # created concurrently, correct it like any other shard
+                shards[shard_key] = table.get_item(Key={"id": shard_key}, ConsistentRead=True)["Item"]
+        stored = {member: int(count) for member, count in shards[shard_key]["value"].items()}
+        # members left at zero by the alarm state collector are included with no change so they get removed
+        changed = [(member, shard_counts.get(member, 0) - stored.get(member, 0)) for member in sorted(set(stored) | set(shard_counts))
+                   if shard_counts.get(member, 0) != stored.get(member, 0) or stored.get(member, 0) <= 0]
+        shard_version = int(shards[shard_key].get("version", 0))
+        if changed:
+            shard_version = counter_maps.update_counter_shard(table, shard_key, changed)
+            rewritten = rewritten + 1
+        version = version + shard_version
+    if rewritten:
+        print("counter map {}: {} of {} shards corrected".format(key, rewritten, COUNTER_MAP_SHARDS))
+    if len(shards) < COUNTER_MAP_SHARDS:
+        # the map was just built, drop the single unsharded item of earlier versions
+        table.delete_item(Key={"id": key})
+    counter_maps.counter_map_built(key)
+    return version
+
+
+def change_counter_map(key, deltas, ddb_resource=None):
+    """
+    Add {member: delta} to the counts of a counter map, removing members that drop to zero.
+    Returns False if the map had not been built, its changes are skipped. Errors are raised to the caller.
+    """
+    if ddb_resource is None:
+        ddb_resource = msam_settings.DYNAMO_RESOURCE
+    return counter_maps.change_counter_map(ddb_resource.Table(msam_settings.SETTINGS_TABLE_NAME), key, deltas)
 
 
 def filtered_alarm(alarm):
     """
     Restructure a CloudWatch alarm into a simpler form.
     """
-    arn = [match.value for match in parse('$..AlarmArn').find(alarm)]
-    name = [match.value for match in parse('$..AlarmName').find(alarm)]
-    metric = [match.value for match in parse('$..MetricName').find(alarm)]
-    namespace = [match.value for match in parse('$..Namespace').find(alarm)]
-    state = [match.value for match in parse('$..StateValue').find(alarm)]
-    updated = [match.value for match in parse('$..StateUpdatedTimestamp').find(alarm)]
+    updated = extractors.ALARM_STATE_UPDATED.first(alarm)
     filtered = {
-        "AlarmArn": arn[0] if arn else None,
-        "AlarmName": name[0] if name else None,
-        "MetricName": metric[0] if metric else None,
-        "Namespace": namespace[0] if namespace else None,
-        "StateValue": state[0] if state else None,
-        "StateUpdated": int(updated[0].timestamp()) if updated else None
+        "AlarmArn": extractors.ALARM_ARN.first(alarm),
+        "AlarmName": extractors.ALARM_NAME.first(alarm),
+        "MetricName": extractors.ALARM_METRIC_NAME.first(alarm),
+        "Namespace": extractors.ALARM_NAMESPACE.first(alarm),
+        "StateValue": extractors.ALARM_STATE_VALUE.first(alarm),
+        "StateUpdated": int(updated.timestamp()) if updated else None
     }
-    print(filtered)
     return filtered
 
 
-def get_cloudwatch_alarms_region(region):
+def describe_region_alarms(region, client=None):
     """
-    API entry point to retrieve all CloudWatch alarms for a given region.
+    Retrieve all CloudWatch metric alarms for a given region in their simpler form. Errors are raised to the caller.
     """
     alarms = []
-    try:
-        region = unquote(region)
+    if client is None:
         client = boto3.client('cloudwatch', region_name=region, config=MSAM_BOTO3_CONFIG)
-        response = client.describe_alarms()
-        # return the response or an empty object
+    response = client.describe_alarms()
+    # return the response or an empty object
+    if "MetricAlarms" in response:
+        for alarm in response["MetricAlarms"]:
+            alarms.append(filtered_alarm(alarm))
+    while "NextToken" in response:
+        response = client.describe_alarms(NextToken=response["NextToken"])
         if "MetricAlarms" in response:
             for alarm in response["MetricAlarms"]:
-                # print(json.dumps(alarm, default=str))
                 alarms.append(filtered_alarm(alarm))
-        while "NextToken" in response:
-            response = client.describe_alarms(NextToken=response["NextToken"])
-            # return the response or an empty object
-            if "MetricAlarms" in response:
-                for alarm in response["MetricAlarms"]:
-                    # print(json.dumps(alarm, default=str))
-                    alarms.append(filtered_alarm(alarm))
+    return alarms
+
+
+def cache_alarm_catalog(region, alarms):
+    """
+    Keep a region's alarm catalog and its ETag in memory for the next requests to this container.
+    """
+    alarms = sorted(alarms, key=lambda alarm: alarm["AlarmName"] or "")
+    digest = hashlib.sha1(json.dumps(alarms, sort_keys=True).encode()).hexdigest()
+    catalog = {"alarms": alarms, "etag": '"{}"'.format(digest), "expires": time.time() + ALARM_CATALOG_CACHE_SECONDS}
+    ALARM_CATALOG_CACHE[region] = catalog
+    return catalog
+
+
+def alarm_catalog_items(table, region):
+    """
+    Return the cached alarm catalog items of a region from the content table.
+    """
+    key = Key('service').eq(ALARM_CATALOG_SERVICE) & Key('region').eq(region)
+    now = int(time.time())
+    # expired items linger until DynamoDB removes them, items of earlier versions have no expiration
+    return [item for item in query_items(table, IndexName="ServiceRegionIndex", KeyConditionExpression=key) if int(item.get("expires", now + 1)) > now]
+
+
+def alarm_catalog(region):
+    """
+    API entry point to retrieve the cached CloudWatch alarm catalog for a region and its ETag.
+    The catalog is served from memory while fresh, then from the content table, and is built from CloudWatch only for a region without one
+    that was not recently found empty.
+    """
+    region = unquote(region)
+    catalog = ALARM_CATALOG_CACHE.get(region)
+    if catalog and catalog["expires"] > time.time():
+        return catalog
+    try:
+        record_alarm_catalog_read(region)
+        ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
+        items = alarm_catalog_items(ddb_resource.Table(CONTENT_TABLE_NAME), region)
+        if items:
+            return cache_alarm_catalog(region, [json.loads(item["data"]) for item in items])
+        emptied = msam_settings.get_setting(ALARM_CATALOG_EMPTY_KEY.format(region))
+        if emptied and int(emptied) + ALARM_CATALOG_EMPTY_SECONDS > time.time():
+            return cache_alarm_catalog(region, [])
+        return cache_alarm_catalog(region, update_alarm_catalog(region))
     except ClientError as error:
         print(error)
+        return {"alarms": [], "etag": None}
+
+
+def record_alarm_catalog_read(region):
+    """
+    Remember that a region's alarm catalog is in use so the scheduled refresh keeps it current.
+    """
+    now = time.time()
+    if ALARM_CATALOG_RECORDED_READS.get(region, 0) + ALARM_CATALOG_READ_RECORD_SECONDS > now:
+        return
+    ALARM_CATALOG_RECORDED_READS[region] = now
+    msam_settings.put_setting(ALARM_CATALOG_READ_KEY.format(region), int(now))
+
+
+def alarm_catalog_regions(region_names):
+    """
+    Return the regions whose alarm catalogs need a refresh: those with subscribed alarms or a recently read catalog.
+    """
+    registry = read_counter_map(SUBSCRIBED_ALARMS_KEY)[0] or {}
+    subscribed = {region_alarm_name.split(':', maxsplit=1)[0] for region_alarm_name in registry}
+    keys = [{"id": ALARM_CATALOG_READ_KEY.format(region)} for region in region_names]
+    reads = {item["id"]: int(item["value"]) for item in dynamodb.batch_get_items(msam_settings.DYNAMO_RESOURCE, msam_settings.SETTINGS_TABLE_NAME, keys)}
+    recent = time.time() - ALARM_CATALOG_READ_SECONDS
+    return [region for region in region_names if region in subscribed or reads.get(ALARM_CATALOG_READ_KEY.format(region), 0) > recent]
+
+
+def update_alarm_catalog(region):
+    """
+    Refresh the cached alarm catalog of a region from CloudWatch, writing only changed alarms and removing deleted ones.
+    Unchanged alarms are rewritten once half of their time to live has passed, so catalogs of regions no longer refreshed expire.
+    """
+    # separate session so regions can be refreshed from concurrent threads
+    session = boto3.session.Session()
+    alarms = describe_region_alarms(region, session.client('cloudwatch', region_name=region, config=MSAM_BOTO3_CONFIG))
+    ddb_table = session.resource('dynamodb', config=MSAM_BOTO3_CONFIG).Table(CONTENT_TABLE_NAME)
+    existing = {item["arn"]: item for item in alarm_catalog_items(ddb_table, region)}
+    now = int(time.time())
+    changed = 0
+    with ddb_table.batch_writer() as batch:
+        for alarm in alarms:
+            data = json.dumps(alarm, sort_keys=True)
+            stored = existing.pop(alarm["AlarmArn"], {})
+            if stored.get("data") != data or int(stored.get("expires", 0)) < now + CACHE_ITEM_TTL // 2:
+                batch.put_item(Item={"arn": alarm["AlarmArn"], "region": region, "service": ALARM_CATALOG_SERVICE,
+                                     "updated": now, "expires": now + CACHE_ITEM_TTL, "data": data})
+                changed = changed + 1
+        # anything left over was deleted from CloudWatch
+        for arn in existing:
+            batch.delete_item(Key={"arn": arn})
+    print("alarm catalog for {}: {} alarms, {} written, {} removed".format(region, len(alarms), changed, len(existing)))
+    if not alarms:
+        # remember the empty result, otherwise every read of the region would describe it again
+        msam_settings.put_setting(ALARM_CATALOG_EMPTY_KEY.format(region), now)
+    cache_alarm_catalog(region, alarms)
     return alarms
 
 
-def get_cloudwatch_events_state(state):
+def update_alarm_catalog_state(region, alarm_arn, state, state_updated):
+    """
+    Apply an alarm state change to the cached alarm catalog of a region.
+    """
+    try:
+        ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
+        if catalog_items.update_catalog_state(ddb_resource.Table(CONTENT_TABLE_NAME), alarm_arn, state, state_updated):
+            ALARM_CATALOG_CACHE.pop(region, None)
+    except ClientError as error:
+        print(error)
+
+
+def query_items(table, **arguments):
+    """
+    Yield the items of a DynamoDB query page by page, following LastEvaluatedKey.
+    """
+    while True:
+        response = table.query(**arguments)
+        for item in response["Items"]:
+            yield item
+        if "LastEvaluatedKey" not in response:
+            break
+        arguments["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def events_state_arguments(state, source=None, attributes=None):
+    """
+    Build the query arguments for pipeline events in a given state, optionally from a specific source and limited to some attributes.
+    """
+    if source:
+        arguments = {"IndexName": 'AlarmStateSourceIndex', "KeyConditionExpression": Key('alarm_state').eq(state) & Key('source').eq(source)}
+    else:
+        arguments = {"IndexName": 'AlarmStateIndex', "KeyConditionExpression": Key('alarm_state').eq(state)}
+    if attributes:
+        # placeholders avoid clashes with reserved words like source
+        names = {"#attr{}".format(index): name for index, name in enumerate(attributes)}
+        arguments["ProjectionExpression"] = ", ".join(names)
+        arguments["ExpressionAttributeNames"] = names
+    return arguments
+
+
+def get_cloudwatch_events_state(state, attributes=None):
     """
     API entry point to retrieve all pipeline events in a given state (set, clear).
     """
-    events = []
-    dynamodb = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
-    table = dynamodb.Table(EVENTS_TABLE_NAME)
-    response = table.query(IndexName='AlarmStateIndex', KeyConditionExpression=Key('alarm_state').eq(state))
-    if "Items" in response:
-        events = response["Items"]
-    return events
+    ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
+    table = ddb_resource.Table(EVENTS_TABLE_NAME)
+    return list(query_items(table, **events_state_arguments(state, attributes=attributes)))
 
-def get_cloudwatch_events_state_source(state, source):
+
+def get_cloudwatch_events_state_source(state, source, attributes=None):
     """
     API entry point to retrieve all pipeline events in a given state (set, clear) from a specific source.
     """
-    events = []
-    dynamodb = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
-    table = dynamodb.Table(EVENTS_TABLE_NAME)
-    response = table.query(IndexName='AlarmStateSourceIndex', KeyConditionExpression=Key('alarm_state').eq(state) & Key('source').eq(source))
-    if "Items" in response:
-        events = response["Items"]
-    return events
+    ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
+    table = ddb_resource.Table(EVENTS_TABLE_NAME)
+    return list(query_items(table, **events_state_arguments(state, source, attributes)))
+
+
+def get_cloudwatch_events_state_page(state, source=None, limit=EVENTS_PAGE_LIMIT, cursor=None):
+    """
+    API entry point to retrieve one page of pipeline events in a given state (set, clear), optionally from a specific source.
+    Returns the events and the cursor of the next page, which is None after the last page.
+    """
+    try:
+        state = unquote(state)
+        source = unquote(source) if source else None
+        ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
+        table = ddb_resource.Table(EVENTS_TABLE_NAME)
+        arguments = events_state_arguments(state, source)
+        arguments["Limit"] = max(1, min(int(limit), EVENTS_PAGE_LIMIT))
+        if cursor:
+            arguments["ExclusiveStartKey"] = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        response = table.query(**arguments)
+        next_cursor = None
+        if "LastEvaluatedKey" in response:
+            next_cursor = base64.urlsafe_b64encode(json.dumps(response["LastEvaluatedKey"]).encode()).decode()
+        return {"events": response["Items"], "cursor": next_cursor}
+    except (ClientError, ValueError, binascii.Error) as error:
+        print(error)
+        return {"message": str(error)}
 
 
 def get_cloudwatch_events_state_groups(state):
@@ -235,33 +592,37 @@ def get_cloudwatch_events_state_groups(state):
     Group all events by down, degraded and running pipelines.
     Currently only applicable to aws.medialive source which includes MediaLive channel and multiplex.
     """
+    return group_pipeline_events(get_cloudwatch_events_state_source(state, "aws.medialive", GROUP_EVENT_ATTRIBUTES))
+
+
+def group_pipeline_events(events):
+    """
+    Classify pipeline events as down, degraded or running in a single pass.
+    An event's pipeline is compared against the down pipelines of the same resource:
+    only its own or only another pipeline down is degraded, both down is down, none down is running.
+    """
     group = {}
     group["down"] = []
     group["running"] = []
     group["degraded"] = []
-    events = get_cloudwatch_events_state_source(state, "aws.medialive")
+    # count the down pipelines of each resource by pipeline
+    down_pipelines = {}
     for event in events:
-        arn = event["resource_arn"]
-        pl = event["detail"]["pipeline"]
-        def is_same_arn(i):
-            return bool(i["resource_arn"] == arn)
-        def is_same_pl(i):
-            return bool("pipeline" in i["detail"] and i["detail"]["pipeline"] == pl)
-        def is_diff_pl(i):
-            return bool("pipeline" in i["detail"] and i["detail"]["pipeline"] != pl)
-        def is_pl_down(i):
-            return bool("pipeline_state" in i["detail"] and not i["detail"]["pipeline_state"])
-        same_arn_events = list(filter(is_same_arn, events))
-        all_down_pipelines = list(filter(is_pl_down, same_arn_events))
-        same_down_pipelines = list(filter(is_same_pl, all_down_pipelines))
-        diff_down_pipelines = list(filter(is_diff_pl, all_down_pipelines))
-        if len(diff_down_pipelines) > 0 and len(same_down_pipelines) == 0:
+        detail = event["detail"]
+        if "pipeline_state" in detail and not detail["pipeline_state"] and "pipeline" in detail:
+            counts = down_pipelines.setdefault(event["resource_arn"], {})
+            counts[detail["pipeline"]] = counts.get(detail["pipeline"], 0) + 1
+    for event in events:
+        counts = down_pipelines.get(event["resource_arn"], {})
+        same_down = counts.get(event["detail"].get("pipeline"), 0)
+        diff_down = sum(counts.values()) - same_down
+        if diff_down > 0 and same_down == 0:
             event["detail"]["degraded"] = bool(True)
             group["degraded"].append(event)
-        elif len(diff_down_pipelines) == 0 and len(same_down_pipelines) > 0:
+        elif diff_down == 0 and same_down > 0:
             event["detail"]["degraded"] = bool(True)
             group["degraded"].append(event)
-        elif len(diff_down_pipelines) > 0 and len(same_down_pipelines) > 0:
+        elif diff_down > 0 and same_down > 0:
             event["detail"]["degraded"] = bool(False)
             group["down"].append(event)
         else:
@@ -273,131 +634,350 @@ def get_cloudwatch_events_state_groups(state):
 def get_cloudwatch_events_resource(resource_arn, start_time=0, end_time=0):
     """
     API entry point to retrieve all CloudWatch events related to a given resource.
+    With day buckets, only the buckets overlapping the time range are queried, in parallel, and merged in order.
+    """
+    resource_arn = unquote(resource_arn)
+    start_time = int(start_time)
+    end_time = int(end_time)
+    partitions = [resource_arn]
+    if CLOUDWATCH_EVENTS_BUCKETS == "day":
+        # events stored before bucketing was enabled stay under the plain ARN until they expire
+        partitions = partitions + cloudwatch_event_buckets(resource_arn, start_time, end_time)
+
+    def query_partition(partition):
+        # separate session so partitions can be queried from concurrent threads
+        session = boto3.session.Session()
+        items = query_resource_events(partition, start_time, end_time, session.resource('dynamodb', config=MSAM_BOTO3_CONFIG))
+        for item in items:
+            item["resource_arn"] = resource_arn
+        return items
+    if len(partitions) == 1:
+        return query_resource_events(resource_arn, start_time, end_time)
+    with ThreadPoolExecutor(max_workers=CLOUDWATCH_EVENTS_QUERY_WORKERS) as executor:
+        results = list(executor.map(query_partition, partitions))
+    return list(heapq.merge(*results, key=lambda item: item["timestamp"]))
+
+
+def query_resource_events(partition, start_time, end_time, ddb_resource=None):
+    """
+    Query one partition of a resource's CloudWatch events for a time range in milliseconds, 0 leaves an end open.
+    The microsecond sort keys are returned as milliseconds, in time order.
+    """
+    key_start = start_time * CLOUDWATCH_EVENTS_KEY_SCALE
+    key_end = end_time * CLOUDWATCH_EVENTS_KEY_SCALE + CLOUDWATCH_EVENTS_KEY_SCALE - 1 if end_time else 0
+    items = query_cloudwatch_events(partition, key_start, key_end, ddb_resource)
+    if start_time > 0:
+        # an open start already covers the lower millisecond keys
+        items = query_cloudwatch_events(partition, start_time, min(end_time or CLOUDWATCH_EVENTS_MILLISECOND_KEYS, CLOUDWATCH_EVENTS_MILLISECOND_KEYS), ddb_resource) + items
+    for item in items:
+        if item["timestamp"] >= CLOUDWATCH_EVENTS_MILLISECOND_KEYS:
+            item["timestamp"] = int(item["timestamp"]) // CLOUDWATCH_EVENTS_KEY_SCALE
+    return items
+
+
+def cloudwatch_event_buckets(resource_arn, start_time, end_time):
+    """
+    Return the day bucket partition keys of a resource that overlap [start_time, end_time] in milliseconds.
+    """
+    if end_time == 0:
+        end_time = int(time.time() * 1000)
+    if start_time == 0:
+        start_time = end_time - CLOUDWATCH_EVENTS_LOOKBACK_DAYS * MILLISECONDS_PER_DAY
+    buckets = []
+    for day in range(start_time // MILLISECONDS_PER_DAY, end_time // MILLISECONDS_PER_DAY + 1):
+        buckets.append("{}#{}".format(resource_arn, time.strftime("%Y%m%d", time.gmtime(day * 86400))))
+    return buckets
+
+
+def query_cloudwatch_events(partition, start_time, end_time, ddb_resource=None):
+    """
+    Query one partition of the CloudWatch events table for a sort key range, 0 leaves an end open.
     """
     cw_events = []
     try:
-        resource_arn = unquote(resource_arn)
-        dynamodb = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
-        table = dynamodb.Table(CLOUDWATCH_EVENTS_TABLE_NAME)
+        if ddb_resource is None:
+            ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
+        table = ddb_resource.Table(CLOUDWATCH_EVENTS_TABLE_NAME)
         key = None
         if (start_time > 0 and end_time > 0):
-            key = Key('resource_arn').eq(resource_arn) & Key('timestamp').between(start_time, end_time)
+            key = Key('resource_arn').eq(partition) & Key('timestamp').between(start_time, end_time)
         elif(start_time > 0 and end_time == 0):
-            key = Key('resource_arn').eq(resource_arn) & Key('timestamp').gte(start_time)
+            key = Key('resource_arn').eq(partition) & Key('timestamp').gte(start_time)
         else:
-            key = Key('resource_arn').eq(resource_arn)
-        response = table.query(KeyConditionExpression=key)
-        if "Items" in response:
-            cw_events = response["Items"]
-        while "LastEvaluatedKey" in response:
-            response = table.query(KeyConditionExpression=key, ExclusiveStartKey=response['LastEvaluatedKey'])
-            if "Items" in response:
-                cw_events = cw_events + response["Items"]
+            key = Key('resource_arn').eq(partition)
+        cw_events = list(query_items(table, KeyConditionExpression=key))
     except ClientError as error:
         print(error)
     return cw_events
 
 
+def get_cloudwatch_event_rollups(resource_arn, start_time=0, end_time=0, interval=CLOUDWATCH_EVENTS_ROLLUP_DEFAULT_INTERVAL):
+    """
+    API entry point to retrieve the CloudWatch event counts of a resource by type and alert state
+    for each interval (in seconds) of a time range in milliseconds, from the counts kept by the event collector.
+    Intervals without events are left out, and nothing is returned unless the collector's EventRollups option is enabled.
+    """
+    resource_arn = unquote(resource_arn)
+    end_time = int(end_time) or int(time.time() * 1000)
+    start_time = int(start_time) or end_time - CLOUDWATCH_EVENTS_LOOKBACK_DAYS * MILLISECONDS_PER_DAY
+    # intervals are whole multiples of the stored rollup interval
+    interval = max(1, -(-int(interval) // CLOUDWATCH_EVENTS_ROLLUP_SECONDS)) * CLOUDWATCH_EVENTS_ROLLUP_SECONDS
+    interval_ms = interval * 1000
+    # a stored item's timestamp is the start of its interval, so include the one containing start_time
+    rollup_start = start_time - start_time % (CLOUDWATCH_EVENTS_ROLLUP_SECONDS * 1000)
+    buckets = {}
+    totals = {}
+    for item in query_cloudwatch_events(CLOUDWATCH_EVENTS_ROLLUP_PARTITION.format(resource_arn), max(rollup_start, 1), end_time):
+        started = int(item["timestamp"]) // interval_ms * interval_ms
+        bucket = buckets.setdefault(started, {"start_time": started, "total": 0, "counts": {}})
+        for name, value in item.items():
+            if name.startswith("count#"):
+                _, state, event_type = name.split("#", 2)
+                bucket["counts"].setdefault(event_type, {})
+                bucket["counts"][event_type][state] = bucket["counts"][event_type].get(state, 0) + int(value)
+                totals.setdefault(event_type, {})
+                totals[event_type][state] = totals[event_type].get(state, 0) + int(value)
+                bucket["total"] = bucket["total"] + int(value)
+    return {
+        "resource_arn": resource_arn,
+        "start_time": start_time,
+        "end_time": end_time,
+        "interval": interval,
+        "totals": totals,
+        "buckets": [buckets[started] for started in sorted(buckets)]
+    }
+
+
 def incoming_cloudwatch_alarm(event, _):
     """
     Standard AWS Lambda entry point for receiving CloudWatch alarm notifications.
+    Records are grouped by alarm and only the latest state of each alarm is applied.
     """
     print(event)
     try:
         updated_timestamp = int(time.time())
-        ddb_table_name = ALARMS_TABLE_NAME
-        ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
-        ddb_table = ddb_resource.Table(ddb_table_name)
-        for record in event["Records"]:
-            region = (record["Sns"]["TopicArn"]).split(":")[3]
-            alarm = json.loads(record["Sns"]["Message"])
-            alarm_name = [match.value for match in parse('$..AlarmName').find(alarm)]
-            # look up the resources with this region alarm name
-            metric = [match.value for match in parse('$..MetricName').find(alarm)]
-            namespace = [match.value for match in parse('$..Namespace').find(alarm)]
-            state = [match.value for match in parse('$..NewStateValue').find(alarm)]
-            updated = [match.value for match in parse('$..StateChangeTime').find(alarm)]
-            region_alarm_name = "{}:{}".format(region, alarm_name[0] if alarm_name else None)
-            subscribers = subscribers_to_alarm(alarm_name[0] if alarm_name else None, region)
-            for resource_arn in subscribers:
+        notifications = latest_alarm_notifications(event["Records"])
+        print("{} records for {} alarms".format(len(event["Records"]), len(notifications)))
+        items = []
+        transitions = []
+        for notification in notifications.values():
+            updated = notification["StateChangeTime"]
+            state_updated = int(datetime.datetime.strptime(updated, '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()) if updated else None
+            notification["StateUpdated"] = state_updated
+            # the stored rows are read anyway to find the subscribers, so compare against them
+            for stored in alarm_subscriber_records(notification["AlarmName"], notification["Region"]):
                 item = {
-                    "RegionAlarmName": region_alarm_name,
-                    "ResourceArn": resource_arn,
-                    "Namespace": namespace[0] if namespace else None,
-                    "StateUpdated": int(datetime.datetime.strptime(updated[0], '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()) if updated else None,
-                    "StateValue": state[0] if state else None,
+                    "RegionAlarmName": notification["RegionAlarmName"],
+                    "ResourceArn": stored["ResourceArn"],
+                    "Namespace": notification["Namespace"],
+                    "StateUpdated": state_updated,
+                    "StateValue": notification["StateValue"],
                     "Updated": updated_timestamp
                 }
-                ddb_table.put_item(Item=item)
-                print("{} updated via alarm notification".format(resource_arn))
+                if alarm_state_changed(item, stored):
+                    items.append(item)
+                    transitions.append((stored["ResourceArn"], stored.get("StateValue"), notification["StateValue"]))
+        print("{} subscriber rows updated via alarm notification".format(len(items)))
+        if items:
+            put_alarm_records(items)
+            change_alarm_state_counts(transitions)
+        for notification in notifications.values():
+            if notification["AlarmArn"]:
+                update_alarm_catalog_state(notification["Region"], notification["AlarmArn"], notification["StateValue"], notification["StateUpdated"])
     except ClientError as error:
         print(error)
     return True
 
 
+def latest_alarm_notifications(records):
+    """
+    Reduce SNS alarm records to the latest notification of each alarm: {RegionAlarmName: notification}.
+    """
+    notifications = {}
+    for record in records:
+        region = (record["Sns"]["TopicArn"]).split(":")[3]
+        alarm = json.loads(record["Sns"]["Message"])
+        alarm_name = extractors.NOTIFICATION_ALARM_NAME.first(alarm)
+        notification = {
+            "Region": region,
+            "AlarmName": alarm_name,
+            "RegionAlarmName": "{}:{}".format(region, alarm_name),
+            "AlarmArn": extractors.NOTIFICATION_ALARM_ARN.first(alarm),
+            "Namespace": extractors.NOTIFICATION_NAMESPACE.first(alarm),
+            "StateValue": extractors.NOTIFICATION_STATE_VALUE.first(alarm),
+            "StateChangeTime": extractors.NOTIFICATION_STATE_CHANGE_TIME.first(alarm)
+        }
+        # the ISO timestamps from CloudWatch compare in time order, later records win ties
+        previous = notifications.get(notification["RegionAlarmName"])
+        if previous is None or (notification["StateChangeTime"] or "") >= (previous["StateChangeTime"] or ""):
+            notifications[notification["RegionAlarmName"]] = notification
+    return notifications
+
+
 def subscribe_resource_to_alarm(request, alarm_name, region):
     """
     API entry point to subscribe one or more nodes to a CloudWatch alarm in a region.
     """
     try:
-        alarm_name = unquote(alarm_name)
-        region = unquote(region)
-        region_alarm_name = "{}:{}".format(region, alarm_name)
-        ddb_table_name = ALARMS_TABLE_NAME
-        ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
-        ddb_table = ddb_resource.Table(ddb_table_name)
-        resources = request.json_body
-        for resource_arn in resources:
-            print(resource_arn)
-            # store it
-            item = {"RegionAlarmName": region_alarm_name, "ResourceArn": resource_arn}
-            ddb_table.put_item(Item=item)
-            update_alarm_subscriber(region, alarm_name, resource_arn)
+        subscribe_alarms(unquote(region), [unquote(alarm_name)], request.json_body)
         return True
     except ClientError as error:
         print(error)
         return False
 
 
-def subscribed_with_state(alarm_state):
+def subscribe_alarms_bulk(request):
     """
-    API entry point to return nodes subscribed to alarms in a given alarm state (OK, ALARM, INSUFFICIENT_DATA).
+    API entry point to subscribe many nodes to many CloudWatch alarms.
+    The body is {"alarms": [{"Region": region, "AlarmName": name}, ...], "resources": [ARN, ...]}.
     """
-    resources = {}
     try:
-        alarm_state = unquote(alarm_state)
-        ddb_table_name = ALARMS_TABLE_NAME
-        ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
-        ddb_table = ddb_resource.Table(ddb_table_name)
-        response = ddb_table.query(IndexName='StateValueIndex', KeyConditionExpression=Key('StateValue').eq(alarm_state))
-        for item in response["Items"]:
-            # store it
-            if item["ResourceArn"] in resources:
-                entry = resources[item["ResourceArn"]]
-                entry["AlarmCount"] = entry["AlarmCount"] + 1
-            else:
-                entry = {"ResourceArn": item["ResourceArn"], "AlarmCount": 1}
-            resources[item["ResourceArn"]] = entry
-        while "LastEvaluatedKey" in response:
-            response = ddb_table.query(IndexName='StateValueIndex', KeyConditionExpression=Key('StateValue').eq(alarm_state), ExclusiveStartKey=response['LastEvaluatedKey'])
-            for item in response["Items"]:
-                # store it
-                if item["ResourceArn"] in resources:
-                    entry = resources[item["ResourceArn"]]
-                    entry["AlarmCount"] = entry["AlarmCount"] + 1
-                else:
-                    entry = {"ResourceArn": item["ResourceArn"], "AlarmCount": 1}
-                resources[item["ResourceArn"]] = entry
+        body = request.json_body
+        for region, alarm_names in bulk_alarm_names(body["alarms"]).items():
+            subscribe_alarms(region, alarm_names, body["resources"])
+        return True
+    except (ClientError, KeyError, TypeError) as error:
+        print(error)
+        return False
+
+
+def bulk_alarm_names(alarms):
+    """
+    Group a bulk request's alarms by region: {region: [alarm name, ...]}.
+    """
+    regions = {}
+    for alarm in alarms:
+        names = regions.setdefault(alarm["Region"], [])
+        if alarm["AlarmName"] not in names:
+            names.append(alarm["AlarmName"])
+    return regions
+
+
+def stored_alarm_rows(keys, ddb_resource):
+    """
+    Read many alarms table rows with BatchGetItem. Returns {(RegionAlarmName, ResourceArn): row} for the rows found.
+    The keys must be unique.
+    """
+    items = dynamodb.batch_get_items(ddb_resource, ALARMS_TABLE_NAME, [{"RegionAlarmName": key[0], "ResourceArn": key[1]} for key in keys],
+                                     ProjectionExpression="RegionAlarmName, ResourceArn, StateValue")
+    found = {(item["RegionAlarmName"], item["ResourceArn"]): item for item in items}
+    return found
+
+
+def subscribe_alarms(region, alarm_names, resource_arns):
+    """
+    Subscribe nodes to CloudWatch alarms in a region.
+    The alarms are described once and all subscriber rows are written with their current state in batches.
+    """
+    # repeated names would repeat keys, which BatchGetItem rejects and the registry would count twice
+    alarm_names = list(dict.fromkeys(alarm_names))
+    resource_arns = list(dict.fromkeys(resource_arns))
+    ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
+    keys = [("{}:{}".format(region, name), arn) for name in alarm_names for arn in resource_arns]
+    stored = stored_alarm_rows(keys, ddb_resource)
+    cloudwatch = boto3.client('cloudwatch', region_name=region, config=MSAM_BOTO3_CONFIG)
+    updated = int(time.time())
+    items = {}
+    for index in range(0, len(alarm_names), DESCRIBE_ALARMS_MAX_NAMES):
+        chunk = alarm_names[index:index + DESCRIBE_ALARMS_MAX_NAMES]
+        response = cloudwatch.describe_alarms(AlarmNames=chunk)
+        alarms = response['CompositeAlarms'] + response['MetricAlarms']
+        while "NextToken" in response:
+            response = cloudwatch.describe_alarms(AlarmNames=chunk, NextToken=response["NextToken"])
+            alarms = alarms + response['CompositeAlarms'] + response['MetricAlarms']
+        for item in [item for alarm in alarms for item in alarm_records(region, alarm, resource_arns, updated)]:
+            items[(item["RegionAlarmName"], item["ResourceArn"])] = item
+    # alarms that could not be described are still subscribed, their state arrives with the next update
+    for key in keys:
+        items.setdefault(key, {"RegionAlarmName": key[0], "ResourceArn": key[1]})
+    print("subscribe {} nodes to {} alarms in region {}".format(len(resource_arns), len(alarm_names), region))
+    put_alarm_records(list(items.values()), ddb_resource)
+    added = {}
+    for key in keys:
+        if key not in stored:
+            added[key[0]] = added.get(key[0], 0) + 1
+    change_alarm_subscribers(added)
+    change_alarm_state_counts([(key[1], stored.get(key, {}).get("StateValue"), item.get("StateValue")) for key, item in items.items()])
+
+
+def alarm_state_view(alarm_state):
+    """
+    Return the subscribers with alarms in a state from the materialized counts, with the counts' version and an ETag.
+    The counts are built from the StateValueIndex the first time a state is read.
+    """
+    alarm_state = unquote(alarm_state)
+    key = ALARM_STATE_COUNTS_KEY.format(alarm_state)
+    counts = {}
+    version = 0
+    try:
+        counts, version = read_counter_map(key)
+        if counts is None:
+            counts = state_index_counts(alarm_state)
+            version = write_counter_map(key, counts)
     except ClientError as error:
         print(error)
-    return list(resources.values())
+        counts = {}
+    subscribers = [{"ResourceArn": resource_arn, "AlarmCount": int(count)} for resource_arn, count in sorted(counts.items()) if count > 0]
+    return {"subscribers": subscribers, "version": version, "etag": '"{}-{}"'.format(alarm_state, version)}
 
 
-def subscribers_to_alarm(alarm_name, region):
+def state_index_counts(alarm_state):
     """
-    API entry point to return subscribed nodes of a CloudWatch alarm in a region.
+    Count the alarms in a state of each subscribed node by paging the StateValueIndex.
+    """
+    counts = {}
+    ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
+    ddb_table = ddb_resource.Table(ALARMS_TABLE_NAME)
+    for item in query_items(ddb_table, IndexName='StateValueIndex', KeyConditionExpression=Key('StateValue').eq(alarm_state)):
+        counts[item["ResourceArn"]] = counts.get(item["ResourceArn"], 0) + 1
+    return counts
+
+
+def change_alarm_state_counts(transitions, ddb_resource=None):
+    """
+    Apply (resource ARN, old state, new state) transitions of alarm rows to the materialized per-state counts.
+    A state whose counts have not been built yet is skipped, its first read builds it from the alarms table.
+    """
+    deltas = {}
+    for resource_arn, old_state, new_state in transitions:
+        if old_state == new_state:
+            continue
+        if old_state:
+            state_deltas = deltas.setdefault(old_state, {})
+            state_deltas[resource_arn] = state_deltas.get(resource_arn, 0) - 1
+        if new_state:
+            state_deltas = deltas.setdefault(new_state, {})
+            state_deltas[resource_arn] = state_deltas.get(resource_arn, 0) + 1
+    for state, state_deltas in deltas.items():
+        try:
+            change_counter_map(ALARM_STATE_COUNTS_KEY.format(state), state_deltas, ddb_resource)
+        except ClientError as error:
+            print(error)
+
+
+def reconcile_alarm_state_counts(alarm_map):
+    """
+    Rewrite the materialized per-state counts from a subscribed_alarm_map() result where they have drifted.
+    """
+    state_counts = {state: {} for state in ALARM_STATES}
+    for alarms in alarm_map.values():
+        for subscribers in alarms.values():
+            for resource_arn, stored in subscribers.items():
+                if stored.get("StateValue"):
+                    counts = state_counts.setdefault(stored["StateValue"], {})
+                    counts[resource_arn] = counts.get(resource_arn, 0) + 1
+    for state, counts in state_counts.items():
+        try:
+            write_counter_map(ALARM_STATE_COUNTS_KEY.format(state), counts)
+        except ClientError as error:
+            print(error)
+
+
+def alarm_subscriber_records(alarm_name, region):
+    """
+    Return the stored alarm rows of all subscribed nodes of a CloudWatch alarm in a region.
     """
-    subscribers = set()
+    items = []
     try:
         alarm_name = unquote(alarm_name)
         region = unquote(region)
@@ -407,15 +987,20 @@ def subscribers_to_alarm(alarm_name, region):
         ddb_table = ddb_resource.Table(ddb_table_name)
         ddb_index_name = 'RegionAlarmNameIndex'
         response = ddb_table.query(IndexName=ddb_index_name, KeyConditionExpression=Key('RegionAlarmName').eq(region_alarm_name))
-        for item in response["Items"]:
-            subscribers.add(item["ResourceArn"])
+        items = response["Items"]
         while "LastEvaluatedKey" in response:
             response = ddb_table.query(IndexName=ddb_index_name, KeyConditionExpression=Key('RegionAlarmName').eq(region_alarm_name), ExclusiveStartKey=response['LastEvaluatedKey'])
-            for item in response["Items"]:
-                subscribers.add(item["ResourceArn"])
+            items = items + response["Items"]
     except ClientError as error:
         print(error)
-    return sorted(subscribers)
+    return items
+
+
+def subscribers_to_alarm(alarm_name, region):
+    """
+    API entry point to return subscribed nodes of a CloudWatch alarm in a region.
+    """
+    return sorted({item["ResourceArn"] for item in alarm_subscriber_records(alarm_name, region)})
 
 
 def unsubscribe_resource_from_alarm(request, alarm_name, region):
@@ -423,19 +1008,45 @@ def unsubscribe_resource_from_alarm(request, alarm_name, region):
     API entry point to subscribe one or more nodes to a CloudWatch alarm in a region.
     """
     try:
-        alarm_name = unquote(alarm_name)
-        region = unquote(region)
-        region_alarm_name = "{}:{}".format(region, alarm_name)
-        ddb_table_name = ALARMS_TABLE_NAME
-        ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
-        ddb_table = ddb_resource.Table(ddb_table_name)
-        resources = request.json_body
-        for resource_arn in resources:
-            # store it
-            item = {"RegionAlarmName": region_alarm_name, "ResourceArn": resource_arn}
-            # delete it
-            ddb_table.delete_item(Key=item)
+        unsubscribe_alarms(unquote(region), [unquote(alarm_name)], request.json_body)
         return True
     except ClientError as error:
         print(error)
         return False
+
+
+def unsubscribe_alarms_bulk(request):
+    """
+    API entry point to unsubscribe many nodes from many CloudWatch alarms.
+    The body is {"alarms": [{"Region": region, "AlarmName": name}, ...], "resources": [ARN, ...]}.
+    """
+    try:
+        body = request.json_body
+        for region, alarm_names in bulk_alarm_names(body["alarms"]).items():
+            unsubscribe_alarms(region, alarm_names, body["resources"])
+        return True
+    except (ClientError, KeyError, TypeError) as error:
+        print(error)
+        return False
+
+
+def unsubscribe_alarms(region, alarm_names, resource_arns):
+    """
+    Unsubscribe nodes from CloudWatch alarms in a region, deleting the subscriber rows in batches.
+    """
+    alarm_names = list(dict.fromkeys(alarm_names))
+    resource_arns = list(dict.fromkeys(resource_arns))
+    ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
+    keys = [("{}:{}".format(region, name), arn) for name in alarm_names for arn in resource_arns]
+    # the deletes do not return old rows, so read them first for the registry and state counts
+    stored = stored_alarm_rows(keys, ddb_resource)
+    print("unsubscribe {} nodes from {} alarms in region {}".format(len(resource_arns), len(alarm_names), region))
+    ddb_table = ddb_resource.Table(ALARMS_TABLE_NAME)
+    with ddb_table.batch_writer(overwrite_by_pkeys=["RegionAlarmName", "ResourceArn"]) as batch:
+        for key in keys:
+            batch.delete_item(Key={"RegionAlarmName": key[0], "ResourceArn": key[1]})
+    removed = {}
+    for key in stored:
+        removed[key[0]] = removed.get(key[0], 0) + 1
+    change_alarm_subscribers({region_alarm_name: -count for region_alarm_name, count in removed.items()})
+    change_alarm_state_counts([(row["ResourceArn"], row.get("StateValue"), None) for row in stored.values()])
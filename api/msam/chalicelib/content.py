@@ -19,6 +19,37 @@ CONTENT_TABLE_NAME = os.environ["CONTENT_TABLE_NAME"]
 STAMP = os.environ["BUILD_STAMP"]
 MSAM_BOTO3_CONFIG = Config(user_agent="aws-media-services-applications-mapper/{stamp}/content.py".format(stamp=STAMP))
 
+# resource tags that place nodes on diagrams and tiles
+DIAGRAM_TAG = "MSAM-Diagram"
+TILE_TAG = "MSAM-Tile"
+
+# resource tag naming the node type of managed instances
+NODE_TYPE_TAG = "MSAM-NodeType"
+
+# sparse index of cache items carrying one of the tags above
+TAGGED_INDEX_NAME = "TaggedIndex"
+TAGGED_VALUE = "MSAM"
+
+
+def tag_attributes(config):
+    """
+    Return the top-level tag projection attributes for a cached resource.
+    Only resources with an MSAM-Diagram, MSAM-Tile or MSAM-NodeType tag get attributes, which keeps the tagged index sparse.
+    """
+    attributes = {}
+    tags = config.get("Tags") if isinstance(config, dict) else None
+    if isinstance(tags, dict):
+        if tags.get(DIAGRAM_TAG):
+            attributes["tag_diagram"] = tags[DIAGRAM_TAG]
+        if tags.get(TILE_TAG):
+            attributes["tag_tile"] = tags[TILE_TAG]
+        if tags.get(NODE_TYPE_TAG):
+            attributes["node_type"] = tags[NODE_TYPE_TAG]
+    if attributes:
+        attributes["tagged"] = TAGGED_VALUE
+    return attributes
+
+
 def put_ddb_items(items):
     """
     Add a list of cache items to the content (cache) DynamoDB table.
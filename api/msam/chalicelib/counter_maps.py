@@ -0,0 +1,103 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""
+This file contains helper functions for counter maps, {member: count} maps kept in sharded settings items.
+It is shared with the alarm state collector in api/events, so it must not import other chalicelib modules.
+"""
+
+import hashlib
+import time
+
+from botocore.exceptions import ClientError
+
+# counter maps are split by member hash across this many settings items ("<key>#<shard>"), each far below the 400 KB item limit
+COUNTER_MAP_SHARDS = 16
+# counter map members changed per UpdateItem call, keeps the update expression small
+COUNTER_MAP_CHUNK = 25
+
+# counter map of each state's subscriber alarm counts: {resource ARN: alarm count}
+ALARM_STATE_COUNTS_KEY = "subscribed-alarm-state-{}"
+
+# maps found not built are left alone by this container for this many seconds, instead of failing a write per change
+UNBUILT_RETRY_SECONDS = 60
+UNBUILT_COUNTER_MAPS = {}
+
+
+def counter_shard_key(key, member):
+    """
+    Return the settings key of the counter map shard holding a member.
+    """
+    return "{}#{}".format(key, int(hashlib.sha1(member.encode("utf-8")).hexdigest(), 16) % COUNTER_MAP_SHARDS)
+
+
+def counter_map_built(key):
+    """
+    Forget that a counter map was found not built, after it has been built.
+    """
+    UNBUILT_COUNTER_MAPS.pop(key, None)
+
+
+def change_counter_map(table, key, deltas):
+    """
+    Add {member: delta} to the counts of a counter map in the settings table with atomic updates of its shards,
+    removing members that drop to zero. Returns False if the map has not been built, its changes are skipped.
+    Errors are raised to the caller.
+    """
+    if UNBUILT_COUNTER_MAPS.get(key, 0) > time.time():
+        return False
+    shards = {}
+    for member, delta in deltas.items():
+        if delta:
+            shards.setdefault(counter_shard_key(key, member), []).append((member, delta))
+    for shard_key, changed in shards.items():
+        try:
+            update_counter_shard(table, shard_key, changed)
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            # all shards are built together, so none of the others exist either
+            UNBUILT_COUNTER_MAPS[key] = time.time() + UNBUILT_RETRY_SECONDS
+            return False
+    return True
+
+
+def update_counter_shard(table, shard_key, changed):
+    """
+    Add [(member, delta), ...] to the members of a built counter map shard in chunks of atomic updates,
+    removing members at or below zero. Returns the shard's new version. Errors are raised to the caller.
+    """
+    version = 0
+    for index in range(0, len(changed), COUNTER_MAP_CHUNK):
+        names = {"#value": "value", "#version": "version"}
+        values = {":zero": 0, ":one": 1}
+        setters = []
+        for position, (member, delta) in enumerate(changed[index:index + COUNTER_MAP_CHUNK]):
+            names["#m{}".format(position)] = member
+            values[":delta{}".format(position)] = delta
+            setters.append("#value.#m{0} = if_not_exists(#value.#m{0}, :zero) + :delta{0}".format(position))
+        response = table.update_item(Key={"id": shard_key},
+                                     UpdateExpression="SET {} ADD #version :one".format(", ".join(setters)),
+                                     ConditionExpression="attribute_exists(#value)",
+                                     ExpressionAttributeNames=names,
+                                     ExpressionAttributeValues=values,
+                                     ReturnValues="UPDATED_NEW")
+        version = int(response["Attributes"]["version"])
+        for member, count in response["Attributes"]["value"].items():
+            if count <= 0:
+                remove_counter_member(table, shard_key, member)
+    return version
+
+
+def remove_counter_member(table, shard_key, member):
+    """
+    Remove a member from a counter map shard unless a concurrent change raised its count again.
+    """
+    try:
+        table.update_item(Key={"id": shard_key},
+                          UpdateExpression="REMOVE #value.#member",
+                          ConditionExpression="#value.#member <= :zero",
+                          ExpressionAttributeNames={"#value": "value", "#member": member},
+                          ExpressionAttributeValues={":zero": 0})
+    except ClientError as error:
+        if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
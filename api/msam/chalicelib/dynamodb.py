@@ -0,0 +1,35 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""
+This file contains helper functions shared by the modules that read DynamoDB.
+"""
+
+import time
+
+# maximum keys per BatchGetItem request
+BATCH_GET_LIMIT = 100
+
+# first and longest pause before retrying keys DynamoDB could not process
+BATCH_GET_RETRY_SECONDS = 0.05
+BATCH_GET_RETRY_MAX_SECONDS = 2
+
+
+def batch_get_items(ddb_resource, table_name, keys, **arguments):
+    """
+    Read many items of a table with BatchGetItem, retrying unprocessed keys with exponential backoff.
+    Keys must be unique. Extra arguments such as ProjectionExpression are passed with each request.
+    Returns the items found in no particular order. Errors are raised to the caller.
+    """
+    items = []
+    for index in range(0, len(keys), BATCH_GET_LIMIT):
+        request = {table_name: dict(arguments, Keys=keys[index:index + BATCH_GET_LIMIT])}
+        pause = BATCH_GET_RETRY_SECONDS
+        while True:
+            response = ddb_resource.batch_get_item(RequestItems=request)
+            items = items + response["Responses"].get(table_name, [])
+            request = response.get("UnprocessedKeys")
+            if not request:
+                break
+            time.sleep(pause)
+            pause = min(pause * 2, BATCH_GET_RETRY_MAX_SECONDS)
+    return items
@@ -0,0 +1,54 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""
+This file contains JSONPath extractors that are compiled once at import time.
+"""
+
+from jsonpath_ng import parse
+
+
+class Extractor:
+    """
+    A JSONPath expression compiled once, with direct key paths for known shapes tried before the recursive search.
+    """
+
+    def __init__(self, expression, *key_paths):
+        self.expression = parse(expression)
+        self.key_paths = key_paths
+
+    def find(self, data):
+        """
+        Return the matching values from the first key path that resolves, or from the full expression if none do.
+        """
+        for key_path in self.key_paths:
+            value = data
+            try:
+                for key in key_path:
+                    value = value[key]
+            except (KeyError, IndexError, TypeError):
+                continue
+            return [value]
+        return [match.value for match in self.expression.find(data)]
+
+    def first(self, data):
+        """
+        Return the first matching value or None.
+        """
+        values = self.find(data)
+        return values[0] if values else None
+
+
+# CloudWatch alarms from DescribeAlarms
+ALARM_ARN = Extractor('$..AlarmArn', ("AlarmArn",))
+ALARM_NAME = Extractor('$..AlarmName', ("AlarmName",))
+ALARM_METRIC_NAME = Extractor('$..MetricName', ("MetricName",))
+ALARM_NAMESPACE = Extractor('$..Namespace', ("Namespace",))
+ALARM_STATE_VALUE = Extractor('$..StateValue', ("StateValue",))
+ALARM_STATE_UPDATED = Extractor('$..StateUpdatedTimestamp', ("StateUpdatedTimestamp",))
+
+# CloudWatch alarm notifications delivered through SNS, ARN and name sit where DescribeAlarms puts them
+NOTIFICATION_ALARM_ARN = ALARM_ARN
+NOTIFICATION_ALARM_NAME = ALARM_NAME
+NOTIFICATION_NAMESPACE = Extractor('$..Namespace', ("Trigger", "Namespace"))
+NOTIFICATION_STATE_VALUE = Extractor('$..NewStateValue', ("NewStateValue",))
+NOTIFICATION_STATE_CHANGE_TIME = Extractor('$..StateChangeTime', ("StateChangeTime",))
@@ -12,6 +12,8 @@ import boto3
 from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 
+from chalicelib import dynamodb
+
 # table names generated by CloudFormation
 LAYOUT_TABLE_NAME = os.environ["LAYOUT_TABLE_NAME"]
 
@@ -61,8 +63,9 @@ def set_node_layout(layout_items):
         # print(request.json_body)
         # layout_items = request.json_body
         # write to the database in batch
-        for item in layout_items:
-            table.put_item(Item=item)
+        with table.batch_writer(overwrite_by_pkeys=["view", "id"]) as batch:
+            for item in layout_items:
+                batch.put_item(Item=item)
         settings = {"message": "saved"}
         print(settings)
     except ClientError as error:
@@ -108,3 +111,18 @@ def has_node(view, node_id):
     except ClientError as error:
         print(error)
         return False
+
+
+def existing_nodes(layout_keys):
+    """
+    Check presence of many nodes across views with BatchGetItem. Returns a set of (view, id) tuples found.
+    """
+    found = set()
+    try:
+        keys = [{"view": key["view"], "id": key["id"]} for key in layout_keys]
+        items = dynamodb.batch_get_items(DYNAMO_RESOURCE, LAYOUT_TABLE_NAME, keys, ProjectionExpression="#view, #id",
+                                         ExpressionAttributeNames={"#view": "view", "#id": "id"})
+        found = {(item["view"], item["id"]) for item in items}
+    except ClientError as error:
+        print(error)
+    return found
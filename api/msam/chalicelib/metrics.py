@@ -0,0 +1,31 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""
+This file contains helper functions for publishing custom CloudWatch metrics.
+"""
+
+import json
+import time
+
+
+def emit_metric(namespace, metric_name, dimensions, value, unit="Count"):
+    """
+    Publish a single metric datum as a CloudWatch Embedded Metric Format log line.
+    CloudWatch Logs extracts the metric from the Lambda log, so no PutMetricData call is made.
+    """
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": namespace,
+                "Dimensions": [list(dimensions.keys())],
+                "Metrics": [{
+                    "Name": metric_name,
+                    "Unit": unit
+                }]
+            }]
+        },
+        metric_name: value
+    }
+    record.update(dimensions)
+    print(json.dumps(record))
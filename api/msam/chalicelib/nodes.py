@@ -141,7 +141,11 @@ def medialive_channel_ddb_items(region):
     for channel in medialive_channels(region):
         arn = channel["Arn"]
         service = "medialive-channel"
-        items.append(node_to_ddb_item(arn, service, region, channel))
+        item = node_to_ddb_item(arn, service, region, channel)
+        # top-level copy for the event collector's pipeline state lookup
+        if channel.get("ChannelClass"):
+            item["channel_class"] = channel["ChannelClass"]
+        items.append(item)
     return items
 
 
@@ -189,7 +193,10 @@ def mediapackage_origin_endpoint_ddb_items(region):
     for endpoint in mediapackage_origin_endpoints(region):
         arn = endpoint["Arn"]
         service = "mediapackage-origin-endpoint"
-        items.append(node_to_ddb_item(arn, service, region, endpoint))
+        item = node_to_ddb_item(arn, service, region, endpoint)
+        # top-level copy for the event collector's HarvestJob endpoint lookup
+        item["endpoint_id"] = endpoint["Id"]
+        items.append(item)
     return items
 
 
@@ -285,6 +292,8 @@ def node_to_ddb_item(arn, service, region, config):
     """
     now = int(time.time())
     item = {"arn": arn, "region": region, "service": service, "updated": now, "expires": now + CACHE_ITEM_TTL, "data": json.dumps(config, default=str)}
+    # project MSAM tags to top-level attributes for the tagged index
+    item.update(content.tag_attributes(config))
     return item
 
 
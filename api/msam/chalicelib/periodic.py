@@ -7,16 +7,19 @@ This file contains helper functions for updating the cache.
 import os
 import time
 import xml.etree.ElementTree as ET
-import json
+from concurrent.futures import ThreadPoolExecutor
 
 import boto3
 from botocore.exceptions import ClientError
+from botocore.exceptions import EndpointConnectionError
 from botocore.config import Config
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr, Key
 
 import chalicelib.settings as msam_settings
+from chalicelib import content
 import chalicelib.cloudwatch as cloudwatch_data
 import chalicelib.connections as connection_cache
+from chalicelib import metrics
 import chalicelib.nodes as node_cache
 from chalicelib.cache import regions
 import chalicelib.tags as tags
@@ -31,6 +34,19 @@ MSAM_BOTO3_CONFIG = Config(user_agent="aws-media-services-applications-mapper/{s
 
 SSM_LOG_GROUP_NAME = "MSAM/SSMRunCommand"
 
+# SendCommand accepts up to this many instance ids per call
+SSM_SEND_COMMAND_MAX_INSTANCES = 50
+
+# number of SendCommand calls in flight at once
+SSM_SEND_COMMAND_WORKERS = 10
+
+# number of regions with subscribed alarms or alarm catalogs updated at once
+ALARM_UPDATE_WORKERS = 8
+
+# managed instance node types are reused between invocations for this long
+MANAGED_INSTANCE_CACHE_SECONDS = 300
+MANAGED_INSTANCE_CACHE = {"instances": {}, "expires": 0}
+
 
 def update_alarms():
     """
@@ -38,19 +54,38 @@ def update_alarms():
     """
     try:
         print("update alarms")
-        alarm_groups = {}
-        # group everything by region
-        for alarm in cloudwatch_data.all_subscribed_alarms():
-            region_name = alarm["Region"]
-            alarm_name = alarm["AlarmName"]
-            if region_name not in alarm_groups:
-                alarm_groups[region_name] = []
-            alarm_groups[region_name].append(alarm_name)
-        print(alarm_groups)
-        # update each grouped list for a region
-        for region_name in alarm_groups:
-            alarm_names = alarm_groups[region_name]
-            cloudwatch_data.update_alarms(region_name, alarm_names)
+        # one read of the alarms table, grouped by region and alarm
+        alarm_map = cloudwatch_data.subscribed_alarm_map()
+        # correct any drift in the subscribed alarm registry from the same read
+        cloudwatch_data.reconcile_subscribed_alarms(alarm_map)
+        cloudwatch_data.reconcile_alarm_state_counts(alarm_map)
+        # update each region concurrently
+        with ThreadPoolExecutor(max_workers=ALARM_UPDATE_WORKERS) as executor:
+            list(executor.map(lambda region_name: cloudwatch_data.update_alarms(region_name, alarm_map[region_name]), alarm_map))
+    except ClientError as error:
+        print(error)
+    return True
+
+
+def update_alarm_catalogs():
+    """
+    Entry point for the CloudWatch scheduled task to refresh the cached alarm catalogs of the regions in use.
+    """
+    def update_region(region_name):
+        try:
+            cloudwatch_data.update_alarm_catalog(region_name)
+        except (ClientError, EndpointConnectionError) as error:
+            print(error)
+    try:
+        never_regions = msam_settings.get_setting("never-cache-regions")
+        if never_regions is None:
+            never_regions = []
+        region_names = [region["RegionName"] for region in regions() if region["RegionName"] not in never_regions]
+        # regions nobody subscribes to or views are left alone, their catalog items expire
+        region_names = cloudwatch_data.alarm_catalog_regions(region_names)
+        print("refresh alarm catalogs of {}".format(region_names))
+        with ThreadPoolExecutor(max_workers=ALARM_UPDATE_WORKERS) as executor:
+            list(executor.map(update_region, region_names))
     except ClientError as error:
         print(error)
     return True
@@ -138,8 +173,7 @@ def update_from_tags():
     """
     Updates MSAM diagrams and tiles from tags on cloud resources. Check for MSAM-Diagram and MSAM-Tile tags.
     """
-    tags.update_diagrams()
-    tags.update_tiles()
+    tags.update_from_tags()
 
 
 def ssm_run_command():
@@ -147,38 +181,9 @@ def ssm_run_command():
     Runs all applicable SSM document commands on a given managed instance.
     """
     try:
-        table_name = CONTENT_TABLE_NAME
         ssm_client = boto3.client('ssm', config=MSAM_BOTO3_CONFIG)
-        db_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
-        db_table = db_resource.Table(table_name)
-        instance_ids = {}
-        items = []
-        # get all the managed instances from the DB with tag MSAM-NodeType
-        response = db_table.query(
-            IndexName="ServiceRegionIndex",
-            KeyConditionExpression=Key("service").eq("ssm-managed-instance"),
-            FilterExpression="contains(#data, :tagname)",
-            ExpressionAttributeNames={"#data": "data"},
-            ExpressionAttributeValues={":tagname": "MSAM-NodeType"}
-            )
-        if "Items" in response:
-            items = response["Items"]
-        while "LastEvaluatedKey" in response:
-            response = db_table.query(
-            IndexName="ServiceRegionIndex",
-            KeyConditionExpression=Key("service").eq("ssm-managed-instance"),
-            FilterExpression="contains(#data, :tagname)",
-            ExpressionAttributeNames={"#data": "data"},
-            ExpressionAttributeValues={":tagname": "MSAM-NodeType"},
-            ExclusiveStartKey=response['LastEvaluatedKey']
-            )
-            if "Items" in response:
-                items.append(response["Items"])
-
-        for item in items:
-            data = json.loads(item['data'])
-            if "MSAM-NodeType" in data["Tags"]:
-                instance_ids[data['Id']] = data['Tags']['MSAM-NodeType']
+        # get all the managed instances with tag MSAM-NodeType
+        instance_ids = managed_instance_types()
 
         # get all the SSM documents applicable to MSAM, filtering by MSAM-NodeType tag
         # When we support more than just ElementalLive, add to the list of values for MSAM-NodeType during filtering
@@ -217,7 +222,7 @@ def ssm_run_command():
                 ],
                 NextToken=document_list["NextToken"]
             )
-            document_ids.append(document_list['DocumentIdentifiers'])
+            document_ids = document_ids + document_list['DocumentIdentifiers']
 
         document_names = {}
         for document in document_ids:
@@ -226,37 +231,88 @@ def ssm_run_command():
                     if tag['Key'] == "MSAM-NodeType":
                         document_names[document["Name"]] = tag['Value']
 
-        # loop over all instances and run applicable commands based on node type
-        for id, id_type in instance_ids.items():
-            for name, doc_type in document_names.items():
-                if id_type in doc_type:
-                    # maybe eventually doc type could be comma-delimited string if doc applies to more than one type?
-                    print("running command: %s on %s " % (name, id))
-                    try:
-                        response = ssm_client.send_command(
-                            InstanceIds=[
-                                id,
-                            ],
-                            DocumentName=name,
-                            TimeoutSeconds=600,
-                            Parameters={
-                            },
-                            MaxConcurrency='50',
-                            MaxErrors='0',
-                            CloudWatchOutputConfig={
-                                'CloudWatchLogGroupName': SSM_LOG_GROUP_NAME,
-                                'CloudWatchOutputEnabled': True
-                            }
-                        )
-                        print(response)
-                    except ClientError as error:
-                        print(error)
-                        if error.response['Error']['Code'] == "InvalidInstanceId":
-                            continue
+        # group instances by node type
+        type_instances = {}
+        for instance_id, id_type in instance_ids.items():
+            type_instances.setdefault(id_type, []).append(instance_id)
+
+        # plan one command per document per chunk of applicable instances
+        commands = []
+        for name, doc_type in document_names.items():
+            # maybe eventually doc type could be comma-delimited string if doc applies to more than one type?
+            targets = sorted([instance_id for id_type, ids in type_instances.items() if id_type in doc_type for instance_id in ids])
+            for index in range(0, len(targets), SSM_SEND_COMMAND_MAX_INSTANCES):
+                commands.append((name, targets[index:index + SSM_SEND_COMMAND_MAX_INSTANCES]))
+
+        # send the chunks concurrently, SSM handles the per-instance fan-out
+        with ThreadPoolExecutor(max_workers=SSM_SEND_COMMAND_WORKERS) as executor:
+            list(executor.map(lambda command: ssm_send_command(ssm_client, command[0], command[1]), commands))
     except ClientError as error:
         print(error)
 
 
+def managed_instance_types():
+    """
+    Returns a map of managed instance id to MSAM-NodeType from the sparse tagged index, reused between invocations until it expires.
+    """
+    now = time.time()
+    if MANAGED_INSTANCE_CACHE["expires"] > now:
+        return MANAGED_INSTANCE_CACHE["instances"]
+    instances = {}
+    try:
+        db_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
+        db_table = db_resource.Table(CONTENT_TABLE_NAME)
+        # the index holds only tagged resources and their tag attributes, not the cached data of every instance
+        arguments = {
+            "IndexName": content.TAGGED_INDEX_NAME,
+            "KeyConditionExpression": Key("tagged").eq(content.TAGGED_VALUE),
+            "FilterExpression": Attr("node_type").exists()
+        }
+        response = db_table.query(**arguments)
+        items = response["Items"]
+        while "LastEvaluatedKey" in response:
+            response = db_table.query(ExclusiveStartKey=response['LastEvaluatedKey'], **arguments)
+            items = items + response["Items"]
+        for item in items:
+            if item["arn"].startswith("arn:aws:ssm-managed-instance:"):
+                # the instance id is the last part of the managed instance ARN
+                instances[item["arn"].split("/")[-1]] = item["node_type"]
+        MANAGED_INSTANCE_CACHE["instances"] = instances
+        MANAGED_INSTANCE_CACHE["expires"] = now + MANAGED_INSTANCE_CACHE_SECONDS
+    except ClientError as error:
+        print(error)
+    return instances
+
+
+def ssm_send_command(ssm_client, document_name, instance_ids):
+    """
+    Sends one SSM document command to a chunk of managed instances.
+    """
+    print("running command: %s on %s " % (document_name, instance_ids))
+    try:
+        response = ssm_client.send_command(
+            InstanceIds=instance_ids,
+            DocumentName=document_name,
+            TimeoutSeconds=600,
+            Parameters={
+            },
+            MaxConcurrency='50',
+            # let every instance in the chunk run even if some of them fail
+            MaxErrors='100%',
+            CloudWatchOutputConfig={
+                'CloudWatchLogGroupName': SSM_LOG_GROUP_NAME,
+                'CloudWatchOutputEnabled': True
+            }
+        )
+        print(response)
+    except ClientError as error:
+        print(error)
+        # one unknown instance rejects the whole chunk, so retry the others individually
+        if error.response['Error']['Code'] == "InvalidInstanceId" and len(instance_ids) > 1:
+            for instance_id in instance_ids:
+                ssm_send_command(ssm_client, document_name, [instance_id])
+
+
 def process_ssm_run_command(event):
     """
     Processes the results from running an SSM command on a managed instance.
@@ -265,7 +321,6 @@ def process_ssm_run_command(event):
     instance_id = event_dict['detail']['instance-id']
     command_name = event_dict['detail']['document-name']
     command_status = event_dict['detail']['status']
-    cw_client = boto3.client('cloudwatch', config=MSAM_BOTO3_CONFIG)
     log_client = boto3.client('logs', config=MSAM_BOTO3_CONFIG)
     dimension_name = "Instance ID"
     metric_name = command_name
@@ -274,18 +329,14 @@ def process_ssm_run_command(event):
     try:
         # test to make sure stream names are always of this format, esp if you create your own SSM document
         log_stream_name = event_dict['detail']['command-id'] + "/" + instance_id + "/aws-runShellScript/stdout"
-        
-        response = log_client.get_log_events(
-                logGroupName=SSM_LOG_GROUP_NAME,
-                logStreamName=log_stream_name,
-            )
-        #print(response)
+        # command output is read lazily, page by page
+        messages = ssm_log_messages(log_client, log_stream_name)
         if command_status == "Success":
             # process document name (command)
             if "MSAMElementalLiveStatus" in command_name:
                 metric_name = "MSAMElementalLiveStatus"
-                for event in response['events']:
-                    if "running" in event['message']:
+                for message in messages:
+                    if "running" in message:
                         status = 1
                         break
             elif "MSAMSsmSystemStatus" in command_name:
@@ -293,9 +344,8 @@ def process_ssm_run_command(event):
                 status = 1
             elif "MSAMElementalLiveActiveAlerts" in command_name:
                 metric_name = "MSAMElementalLiveActiveAlerts"
-                root = ET.fromstring(response['events'][0]['message'])
-                status = len(list(root))
-                if status == 1 and root[0].tag == "empty":
+                status, first_tag = count_xml_children(messages)
+                if status == 1 and first_tag == "empty":
                     status = 0
             else:
                 if "MSAMElementalLiveCompletedEvents" in command_name:
@@ -304,14 +354,13 @@ def process_ssm_run_command(event):
                     metric_name = "MSAMElementalLiveErroredEvents"
                 elif "MSAMElementalLiveRunningEvents" in command_name:
                     metric_name = "MSAMElementalLiveRunningEvents"
-                root = ET.fromstring(response['events'][0]['message'])
-                status = len(root.findall("./live_event"))
+                status, _ = count_xml_children(messages, "live_event")
         else:
             # for the elemental live status, the command itself returns a failure if process is not running at all
             # which is different than when a command fails to execute altogether
             if command_status == "Failed" and "MSAMElementalLiveStatus" in command_name:
-                for event in response['events']:
-                    if "Not Running" in event['message'] or "Active: failed" in event['message']:
+                for message in messages:
+                    if "Not Running" in message or "Active: failed" in message:
                         metric_name = "MSAMElementalLiveStatus"
                         break
             else:
@@ -321,23 +370,61 @@ def process_ssm_run_command(event):
                 status = 1
                 metric_name = "MSAMSsmCommand"+command_status
 
-        cw_client.put_metric_data(
-            Namespace = SSM_LOG_GROUP_NAME,
-            MetricData = [
-                {
-                    'MetricName': metric_name,
-                    'Dimensions': [
-                        {
-                            'Name' : dimension_name,
-                            'Value' : instance_id
-                        },
-                    ],
-                    "Value": status,
-                    "Unit": "Count"
-                }
-            ]
-        )
+        metrics.emit_metric(SSM_LOG_GROUP_NAME, metric_name, {dimension_name: instance_id}, status)
     except ClientError as error:
         print(error)
         print("SSM Command Status: Command %s sent to instance %s has status %s" % (command_name, instance_id, command_status))
         print("Log stream name is %s" % (log_stream_name))
+    except ET.ParseError as error:
+        print(error)
+        print("SSM Command Status: Command %s sent to instance %s returned output that is not valid XML" % (command_name, instance_id))
+
+
+def ssm_log_messages(log_client, log_stream_name):
+    """
+    Yields the messages of an SSM command output log stream from the start, following nextForwardToken paging.
+    """
+    arguments = {
+        "logGroupName": SSM_LOG_GROUP_NAME,
+        "logStreamName": log_stream_name,
+        "startFromHead": True
+    }
+    while True:
+        response = log_client.get_log_events(**arguments)
+        for event in response['events']:
+            yield event['message']
+        # the same token is returned again at the end of the stream
+        next_token = response.get("nextForwardToken")
+        if not next_token or next_token == arguments.get("nextToken"):
+            break
+        arguments["nextToken"] = next_token
+
+
+def count_xml_children(messages, tag=None):
+    """
+    Counts the children of the root element of an XML document fed in chunks, optionally only children with the given tag.
+    Children are discarded as soon as they are counted so memory stays flat. Returns the count and the tag of the first child.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    root = None
+    depth = 0
+    count = 0
+    first_tag = None
+    for message in messages:
+        # log events are output lines without their line breaks, and a tag may span two of them
+        parser.feed(message + "\n")
+        for parse_event, element in parser.read_events():
+            if parse_event == "start":
+                if root is None:
+                    root = element
+                depth = depth + 1
+                continue
+            depth = depth - 1
+            if depth == 1:
+                if first_tag is None:
+                    first_tag = element.tag
+                if tag is None or element.tag == tag:
+                    count = count + 1
+                root.clear()
+    parser.close()
+    return count, first_tag
@@ -8,11 +8,13 @@ import json
 import os
 
 import boto3
+from boto3.dynamodb.conditions import Key
 from botocore.config import Config
 from botocore.exceptions import ClientError
 import stringcase
 
 import chalicelib.channels as channels
+from chalicelib import content
 import chalicelib.settings as settings
 import chalicelib.layout as layout
 
@@ -24,99 +26,95 @@ STAMP = os.environ["BUILD_STAMP"]
 MSAM_BOTO3_CONFIG = Config(user_agent="aws-media-services-applications-mapper/{stamp}/tags.py".format(stamp=STAMP))
 
 
-def update_diagrams():
+def tagged_items():
     """
-    scan for data with tags with MSAM-Diagram name and include in those named diagrams
+    Query the sparse tagged index for all cached resources with an MSAM-Diagram or MSAM-Tile tag.
     """
+    items = []
     try:
-        ddb_table_name = CONTENT_TABLE_NAME
         ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
-        ddb_table = ddb_resource.Table(ddb_table_name)
-        # expensive textual scan
-        response = ddb_table.scan(FilterExpression="contains(#data, :tagname)", ExpressionAttributeNames={"#data": "data"}, ExpressionAttributeValues={":tagname": "MSAM-Diagram"})
+        ddb_table = ddb_resource.Table(CONTENT_TABLE_NAME)
+        key = Key("tagged").eq(content.TAGGED_VALUE)
+        response = ddb_table.query(IndexName=content.TAGGED_INDEX_NAME, KeyConditionExpression=key)
         items = response["Items"]
         # check for paging
         while "LastEvaluatedKey" in response:
-            # scan again with start key
-            response = ddb_table.scan(
-                FilterExpression="contains(#data, :tagname)",
-                ExpressionAttributeNames={"#data": "data"},
-                ExpressionAttributeValues={":tagname": "MSAM-Diagram"},
-                ExclusiveStartKey=response['LastEvaluatedKey'])
+            # query again with start key
+            response = ddb_table.query(IndexName=content.TAGGED_INDEX_NAME, KeyConditionExpression=key, ExclusiveStartKey=response['LastEvaluatedKey'])
             items = items + response["Items"]
-        # filter down the results
+    except ClientError as error:
+        print(error)
+    return items
+
+
+def update_from_tags():
+    """
+    Read the tagged resources once and include them in the diagrams and tiles named by their tags.
+    """
+    items = tagged_items()
+    update_diagrams(items)
+    update_tiles(items)
+
+
+def update_diagrams(items):
+    """
+    include tagged resources with MSAM-Diagram name in those named diagrams
+    """
+    try:
+        # load the diagram list once and map names to view ids
+        diagrams = settings.get_setting("diagrams")
+        if not diagrams:
+            diagrams = []
+        view_ids = {diagram["name"]: diagram["view_id"] for diagram in diagrams}
+        created_diagram = False
+        # group the needed nodes by view id
+        view_nodes = {}
         for record in items:
-            cloud_resource = json.loads(record["data"])
-            if "Tags" in cloud_resource:
-                if "MSAM-Diagram" in cloud_resource["Tags"]:
-                    arn = record["arn"]
-                    diagram_name = cloud_resource["Tags"]["MSAM-Diagram"]
-                    print("arn {} needed on diagram {}".format(arn, diagram_name))
-                    diagrams = settings.get_setting("diagrams")
-                    if not diagrams:
-                        diagrams = []
-                    found_diagram = False
-                    view_id = None
-                    for diagram in diagrams:
-                        if diagram["name"] == diagram_name:
-                            view_id = diagram["view_id"]
-                            found_diagram = True
-                            print("found diagram id {}".format(view_id))
-                    if not found_diagram:
-                        view_id = stringcase.snakecase(diagram_name)
-                        print("new diagram id {}".format(view_id))
-                        diagrams.append({"name": diagram_name, "view_id": view_id})
-                        settings.put_setting("diagrams", diagrams)
-                        print("created diagram id {}".format(view_id))
-                    # check if this node is already on the diagram layout
-                    if not layout.has_node(view_id, arn):
-                        print("adding node {} to diagram id {}".format(arn, view_id))
-                        # add the node arn to the layout
-                        layout_items = [{"view": view_id, "id": arn, "x": 0, "y": 0}]
-                        layout.set_node_layout(layout_items)
-                    else:
-                        print("node {} already on diagram id {}".format(arn, view_id))
+            if "tag_diagram" in record:
+                arn = record["arn"]
+                diagram_name = record["tag_diagram"]
+                if diagram_name not in view_ids:
+                    view_id = stringcase.snakecase(diagram_name)
+                    print("new diagram id {}".format(view_id))
+                    diagrams.append({"name": diagram_name, "view_id": view_id})
+                    view_ids[diagram_name] = view_id
+                    created_diagram = True
+                view_nodes.setdefault(view_ids[diagram_name], set()).add(arn)
+        if created_diagram:
+            settings.put_setting("diagrams", diagrams)
+            print("updated diagram list")
+        # check which nodes are already on their diagram layouts
+        layout_keys = [{"view": view_id, "id": arn} for view_id, arns in view_nodes.items() for arn in sorted(arns)]
+        existing = layout.existing_nodes(layout_keys)
+        # add only the missing node arns to the layouts
+        layout_items = [{"view": key["view"], "id": key["id"], "x": 0, "y": 0} for key in layout_keys if (key["view"], key["id"]) not in existing]
+        for item in layout_items:
+            print("adding node {} to diagram id {}".format(item["id"], item["view"]))
+        if layout_items:
+            layout.set_node_layout(layout_items)
+        print("{} of {} tagged nodes already on diagrams".format(len(existing), len(layout_keys)))
     except ClientError as error:
         print(error)
 
 
-def update_tiles():
+def update_tiles(items):
     """
-    scan for data with tags with MSAM-Tile name and include in those named tiles
+    include tagged resources with MSAM-Tile name in those named tiles
     """
     try:
-        ddb_table_name = CONTENT_TABLE_NAME
-        ddb_resource = boto3.resource('dynamodb', config=MSAM_BOTO3_CONFIG)
-        ddb_table = ddb_resource.Table(ddb_table_name)
-        # very broad textual scan
-        response = ddb_table.scan(FilterExpression="contains(#data, :tagname)", ExpressionAttributeNames={"#data": "data"}, ExpressionAttributeValues={":tagname": "MSAM-Tile"})
-        items = response["Items"]
-        # check for paging
-        while "LastEvaluatedKey" in response:
-            # scan again with start key
-            response = ddb_table.scan(
-                FilterExpression="contains(#data, :tagname)",
-                ExpressionAttributeNames={"#data": "data"},
-                ExpressionAttributeValues={":tagname": "MSAM-Tile"},
-                ExclusiveStartKey=response['LastEvaluatedKey'])
-            items = items + response["Items"]
-        # filter down the results
+        # group the needed nodes by tile name
+        tile_nodes = {}
         for record in items:
-            cloud_resource = json.loads(record["data"])
-            if "Tags" in cloud_resource:
-                if "MSAM-Tile" in cloud_resource["Tags"]:
-                    arn = record["arn"]
-                    tile_name = cloud_resource["Tags"]["MSAM-Tile"]
-                    print("arn {} needed on tile {}".format(arn, tile_name))
-                    nodes = channels.get_channel_nodes(tile_name)
-                    ids = [item["id"] for item in nodes]
-                    print("existing tile contents: {}".format(json.dumps(ids)))
-                    if arn not in ids:
-                        print("adding {} to tile {}".format(arn, tile_name))
-                        ids.append(arn)
-                        print("updated tile contents: {}".format(json.dumps(ids)))
-                        channels.set_channel_nodes(tile_name, ids)
-                    else:
-                        print("already present on tile")
+            if "tag_tile" in record:
+                tile_nodes.setdefault(record["tag_tile"], set()).add(record["arn"])
+        for tile_name, arns in tile_nodes.items():
+            nodes = channels.get_channel_nodes(tile_name)
+            ids = {item["id"] for item in nodes}
+            missing = sorted(arns - ids)
+            if missing:
+                print("adding {} to tile {}".format(json.dumps(missing), tile_name))
+                channels.set_channel_nodes(tile_name, missing)
+            else:
+                print("tagged nodes already present on tile {}".format(tile_name))
     except ClientError as error:
         print(error)
@@ -0,0 +1,106 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""
+This is a tool to benchmark the pipeline event grouping used by the
+/cloudwatch/events/state/{state}/groups endpoint with a synthetic outage-sized event set.
+It compares the single-pass grouping against the previous quadratic filter implementation.
+"""
+
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+# the chalicelib modules read these at import time
+for env_name in ["ALARMS_TABLE_NAME", "EVENTS_TABLE_NAME", "CLOUDWATCH_EVENTS_TABLE_NAME", "CONTENT_TABLE_NAME", "SETTINGS_TABLE_NAME"]:
+    os.environ.setdefault(env_name, "benchmark")
+os.environ.setdefault("BUILD_STAMP", "benchmark")
+os.environ.setdefault("CACHE_ITEM_TTL", "86400")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api", "msam"))
+
+import chalicelib.cloudwatch as cloudwatch_data  # pylint: disable=wrong-import-position
+
+
+def synthetic_events(channel_count, alerts_per_channel, seed):
+    """
+    Generate set MediaLive alerts for many channels with a mix of down and running pipelines.
+    """
+    generator = random.Random(seed)
+    events = []
+    for channel in range(channel_count):
+        arn = "arn:aws:medialive:us-west-2:123456789012:channel:{}".format(channel)
+        for alert in range(alerts_per_channel):
+            events.append({
+                "resource_arn": arn,
+                "alarm_id": "{}-{}".format(channel, alert),
+                "alarm_state": "set",
+                "source": "aws.medialive",
+                "detail": {
+                    "pipeline": str(generator.randint(0, 1)),
+                    "pipeline_state": generator.random() < 0.7
+                }
+            })
+    return events
+
+
+def quadratic_groups(events):
+    """
+    The previous grouping, kept here as the reference for classification and timing.
+    """
+    group = {"down": [], "running": [], "degraded": []}
+    for event in events:
+        arn = event["resource_arn"]
+        pipeline = event["detail"]["pipeline"]
+        same_arn_events = [i for i in events if i["resource_arn"] == arn]
+        all_down_pipelines = [i for i in same_arn_events if "pipeline_state" in i["detail"] and not i["detail"]["pipeline_state"]]
+        same_down_pipelines = [i for i in all_down_pipelines if "pipeline" in i["detail"] and i["detail"]["pipeline"] == pipeline]
+        diff_down_pipelines = [i for i in all_down_pipelines if "pipeline" in i["detail"] and i["detail"]["pipeline"] != pipeline]
+        if diff_down_pipelines and not same_down_pipelines:
+            group["degraded"].append(event)
+        elif not diff_down_pipelines and same_down_pipelines:
+            group["degraded"].append(event)
+        elif diff_down_pipelines and same_down_pipelines:
+            group["down"].append(event)
+        else:
+            group["running"].append(event)
+    return group
+
+
+def timed(function, events):
+    """
+    Run a grouping function on a private copy of the events and return the result and elapsed seconds.
+    """
+    events = copy.deepcopy(events)
+    start = time.perf_counter()
+    result = function(events)
+    return result, time.perf_counter() - start
+
+
+def main():
+    """
+    Parse arguments, run both groupings and print the timings.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark pipeline event grouping with a synthetic outage.')
+    parser.add_argument('--channels', type=int, default=200, help='number of channels with set alerts (default 200)')
+    parser.add_argument('--alerts', type=int, default=10, help='set alerts per channel (default 10)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the synthetic events')
+    args = parser.parse_args()
+
+    events = synthetic_events(args.channels, args.alerts, args.seed)
+    single_pass, single_pass_seconds = timed(cloudwatch_data.group_pipeline_events, events)
+    quadratic, quadratic_seconds = timed(quadratic_groups, events)
+    for name in ["down", "degraded", "running"]:
+        if [event["alarm_id"] for event in single_pass[name]] != [event["alarm_id"] for event in quadratic[name]]:
+            print("classification mismatch in group {}".format(name))
+            sys.exit(1)
+    print("events: {}".format(len(events)))
+    print("down {} degraded {} running {}".format(len(single_pass["down"]), len(single_pass["degraded"]), len(single_pass["running"])))
+    print("single pass: {:.4f}s".format(single_pass_seconds))
+    print("quadratic:   {:.4f}s".format(quadratic_seconds))
+
+
+if __name__ == "__main__":
+    main()
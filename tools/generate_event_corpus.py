@@ -0,0 +1,186 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""
+This is a tool to generate a synthetic JSONL corpus of EventBridge events for replay_events.py.
+It covers MediaLive, MediaConnect, MediaPackage, MediaStore and MediaTailor event shapes
+and CloudWatch alarm state changes, including flapping and duplicate alerts.
+"""
+
+import argparse
+import datetime
+import json
+import random
+import uuid
+
+ACCOUNT = "123456789012"
+
+
+def envelope(generator, moment, region, **fields):
+    """
+    Wrap an event detail in the EventBridge envelope. The fields are source, detail_type, resources and detail.
+    """
+    return {
+        "version": "0",
+        "id": str(uuid.UUID(int=generator.getrandbits(128))),
+        "detail-type": fields["detail_type"],
+        "source": fields["source"],
+        "account": ACCOUNT,
+        "time": moment.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        "region": region,
+        "resources": fields["resources"],
+        "detail": fields["detail"]
+    }
+
+
+def medialive_alert(generator, moment, region, channel):
+    """
+    A MediaLive channel alert, set more often than cleared.
+    """
+    arn = "arn:aws:medialive:{}:{}:channel:{}".format(region, ACCOUNT, channel)
+    detail = {
+        "alarm_state": generator.choice(["SET", "SET", "CLEARED"]),
+        "alarm_id": "{:040x}".format(generator.randint(0, 7)),
+        "alert_type": generator.choice(["RTMP Has No Audio/Video", "Failed to Create Output File or Socket"]),
+        "pipeline": str(generator.randint(0, 1)),
+        "channel_arn": arn,
+        "message": "synthetic alert"
+    }
+    return envelope(generator, moment, region, source="aws.medialive", detail_type="MediaLive Channel Alert", resources=[arn], detail=detail)
+
+
+def medialive_state_change(generator, moment, region, channel):
+    """
+    A MediaLive channel state change.
+    """
+    arn = "arn:aws:medialive:{}:{}:channel:{}".format(region, ACCOUNT, channel)
+    detail = {"channel_arn": arn, "state": generator.choice(["RUNNING", "STOPPED"]), "message": "synthetic state change", "pipelines_running_count": 2}
+    return envelope(generator, moment, region, source="aws.medialive", detail_type="MediaLive Channel State Change", resources=[arn], detail=detail)
+
+
+def medialive_schedule(generator, moment, region, channel):
+    """
+    A CloudTrail BatchUpdateSchedule call on a MediaLive channel.
+    """
+    detail = {
+        "eventName": "BatchUpdateSchedule",
+        "userIdentity": {"arn": "arn:aws:iam::{}:user/operator".format(ACCOUNT)},
+        "requestParameters": {"channelId": str(channel)}
+    }
+    return envelope(generator, moment, region, source="aws.medialive", detail_type="AWS API Call via CloudTrail", resources=[], detail=detail)
+
+
+def mediaconnect_alert(generator, moment, region, flow):
+    """
+    A MediaConnect flow alert.
+    """
+    arn = "arn:aws:mediaconnect:{}:{}:flow:1-{}:synthetic".format(region, ACCOUNT, flow)
+    detail = {
+        "resource-arn": arn,
+        "error-id": generator.randint(1, 4),
+        "errored": generator.random() < 0.6,
+        "error-code": "SOURCE_DISCONNECTED",
+        "error-message": "synthetic source disconnect"
+    }
+    return envelope(generator, moment, region, source="aws.mediaconnect", detail_type="MediaConnect Alert", resources=[arn], detail=detail)
+
+
+def mediapackage_harvest_job(generator, moment, region, endpoint):
+    """
+    A MediaPackage HarvestJob notification naming its origin endpoint.
+    """
+    arn = "arn:aws:mediapackage:{}:{}:harvest_jobs/job-{}".format(region, ACCOUNT, generator.randint(0, 9999))
+    detail = {"harvest_job": {"id": arn.split("/")[-1], "arn": arn, "status": "SUCCEEDED", "origin_endpoint_id": "endpoint-{}".format(endpoint)}}
+    return envelope(generator, moment, region, source="aws.mediapackage", detail_type="MediaPackage HarvestJob Notification", resources=[arn], detail=detail)
+
+
+def mediapackage_input(generator, moment, region, endpoint):
+    """
+    A MediaPackage input notification for a channel.
+    """
+    arn = "arn:aws:mediapackage:{}:{}:channels/channel-{}".format(region, ACCOUNT, endpoint)
+    detail = {"event": "MaxIngestStreamsError", "message": "synthetic input notification"}
+    return envelope(generator, moment, region, source="aws.mediapackage", detail_type="MediaPackage Input Notification", resources=[arn], detail=detail)
+
+
+def mediastore_object(generator, moment, region, container):
+    """
+    A MediaStore object state change, its resource is the object inside the container.
+    """
+    arn = "arn:aws:mediastore:{}:{}:container/container-{}/live/segment{}.ts".format(region, ACCOUNT, container, generator.randint(0, 99999))
+    detail = {"ContentSHA256": "0" * 64, "ContentLength": 188000, "Operation": generator.choice(["PutObject", "DeleteObject"])}
+    return envelope(generator, moment, region, source="aws.mediastore", detail_type="MediaStore Object State Change", resources=[arn], detail=detail)
+
+
+def mediatailor_configuration(generator, moment, region, configuration):
+    """
+    A CloudTrail PutPlaybackConfiguration call on MediaTailor.
+    """
+    arn = "arn:aws:mediatailor:{}:{}:playbackConfiguration/config-{}".format(region, ACCOUNT, configuration)
+    detail = {
+        "eventName": "PutPlaybackConfiguration",
+        "userIdentity": {"arn": "arn:aws:iam::{}:role/operator".format(ACCOUNT)},
+        "responseElements": {"PlaybackConfigurationArn": arn}
+    }
+    return envelope(generator, moment, region, source="aws.mediatailor", detail_type="AWS API Call via CloudTrail", resources=[], detail=detail)
+
+
+def alarm_state_change(generator, moment, region, alarm):
+    """
+    A CloudWatch alarm state change, occasionally without the state to exercise the API fallback.
+    """
+    state = generator.choice(["ALARM", "OK"])
+    detail = {
+        "alarmName": "synthetic-alarm-{}".format(alarm),
+        "state": {"value": state, "timestamp": moment.strftime('%Y-%m-%dT%H:%M:%S.000+0000')},
+        "previousState": {"value": "OK" if state == "ALARM" else "ALARM"}
+    }
+    if generator.random() < 0.05:
+        del detail["state"]
+    return envelope(generator, moment, region, source="aws.cloudwatch", detail_type="CloudWatch Alarm State Change", resources=[], detail=detail)
+
+
+# event shapes with their relative weight in the corpus
+SHAPES = [
+    (medialive_alert, 30),
+    (medialive_state_change, 5),
+    (medialive_schedule, 2),
+    (mediaconnect_alert, 10),
+    (mediapackage_harvest_job, 3),
+    (mediapackage_input, 5),
+    (mediastore_object, 20),
+    (mediatailor_configuration, 2),
+    (alarm_state_change, 23)
+]
+
+
+def main():
+    """
+    Parse arguments and write the corpus to standard output or a file.
+    """
+    parser = argparse.ArgumentParser(description='Generate a synthetic JSONL corpus of media service and alarm events.')
+    parser.add_argument('--events', type=int, default=10000, help='number of events (default 10000)')
+    parser.add_argument('--resources', type=int, default=50, help='number of resources of each kind (default 50)')
+    parser.add_argument('--seconds', type=int, default=600, help='time span of the events in seconds (default 600)')
+    parser.add_argument('--region', default='us-west-2', help='region of the events (default us-west-2)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('--output', help='corpus file to write (default standard output)')
+    args = parser.parse_args()
+
+    generator = random.Random(args.seed)
+    start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    shapes = [shape for shape, _ in SHAPES]
+    weights = [weight for _, weight in SHAPES]
+    lines = []
+    for index in range(args.events):
+        moment = start + datetime.timedelta(seconds=args.seconds * index // max(args.events, 1))
+        shape = generator.choices(shapes, weights)[0]
+        lines.append(json.dumps(shape(generator, moment, args.region, generator.randint(0, args.resources - 1))))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as corpus:
+            corpus.write("\n".join(lines) + "\n")
+    else:
+        print("\n".join(lines))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+# Copyright 2018 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""
+This is a tool to replay a JSONL corpus of EventBridge events through the event collector Lambdas
+(api/events/media_events.py and api/events/cloudwatch_alarm.py) against in-memory DynamoDB,
+CloudWatch and MediaPackage stand-ins. It reports events per second, backend calls per event
+and the resulting table contents. Use generate_event_corpus.py for a synthetic corpus.
+"""
+
+import argparse
+import collections
+import contextlib
+import copy
+import datetime
+import io
+import json
+import os
+import re
+import sys
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+TABLE_KEYS = {
+    "events": ["resource_arn", "alarm_id"],
+    "cloudwatch-events": ["resource_arn", "timestamp"],
+    "content": ["arn"],
+    "alarms": ["RegionAlarmName", "ResourceArn"],
+    "settings": ["id"]
+}
+
+# the collectors read these at import time
+os.environ.setdefault("BUILD_STAMP", "replay")
+os.environ.setdefault("EVENTS_TABLE_REGION", "us-west-2")
+os.environ.setdefault("EVENTS_TABLE_NAME", "events")
+os.environ.setdefault("CLOUDWATCH_EVENTS_TABLE_NAME", "cloudwatch-events")
+os.environ.setdefault("CONTENT_TABLE_NAME", "content")
+os.environ.setdefault("ALARMS_TABLE_NAME", "alarms")
+os.environ.setdefault("SETTINGS_TABLE_NAME", "settings")
+os.environ.setdefault("ITEM_TTL", "86400")
+os.environ.setdefault("EVENT_ROLLUPS", "Yes")
+
+# backend calls by (service, table or empty, operation)
+CALLS = collections.Counter()
+
+# DynamoDB writes at most this many items per BatchWriteItem call
+BATCH_WRITE_LIMIT = 25
+
+
+def condition_values(condition):
+    """
+    Flatten an equality key condition (optionally joined with AND) to {attribute: value}.
+    """
+    expression = condition.get_expression()
+    if expression["operator"] == "AND":
+        values = {}
+        for part in expression["values"]:
+            values.update(condition_values(part))
+        return values
+    if expression["operator"] == "=":
+        return {expression["values"][0].name: expression["values"][1]}
+    raise ValueError("key condition {} is not supported".format(expression["operator"]))
+
+
+def conditional_check_failed(operation):
+    """
+    Return the ClientError DynamoDB raises for a failed condition expression.
+    """
+    return ClientError({"Error": {"Code": "ConditionalCheckFailedException", "Message": "The conditional request failed"}}, operation)
+
+
+class MemoryBatchWriter:
+    """
+    Buffers batch writes like the boto3 batch writer, counting one call per 25 items.
+    """
+
+    def __init__(self, table, overwrite_by_pkeys):
+        """
+        Buffer writes for a table, deduplicated by the given key attributes.
+        """
+        self.table = table
+        self.overwrite_by_pkeys = overwrite_by_pkeys
+        self.buffer = []
+
+    def put_item(self, Item):  # pylint: disable=invalid-name
+        """
+        Queue a put request.
+        """
+        self._add(("put", Item))
+
+    def delete_item(self, Key):  # pylint: disable=invalid-name
+        """
+        Queue a delete request.
+        """
+        self._add(("delete", Key))
+
+    def _add(self, request):
+        """
+        Queue a request, replacing a queued one for the same key, and flush a full batch.
+        """
+        if self.overwrite_by_pkeys:
+            key = tuple(request[1].get(name) for name in self.overwrite_by_pkeys)
+            self.buffer = [queued for queued in self.buffer if tuple(queued[1].get(name) for name in self.overwrite_by_pkeys) != key]
+        self.buffer.append(request)
+        if len(self.buffer) >= BATCH_WRITE_LIMIT:
+            self._flush()
+
+    def _flush(self):
+        """
+        Apply the queued requests as one BatchWriteItem call.
+        """
+        if self.buffer:
+            CALLS[("dynamodb", self.table.name, "batch_write_item")] += 1
+            for action, value in self.buffer:
+                if action == "put":
+                    self.table.items[self.table.key(value)] = copy.deepcopy(value)
+                else:
+                    self.table.items.pop(self.table.key(value), None)
+            self.buffer = []
+
+    def __enter__(self):
+        """
+        Start buffering.
+        """
+        return self
+
+    def __exit__(self, *_):
+        """
+        Flush the remaining requests.
+        """
+        self._flush()
+
+
+class MemoryTable:
+    """
+    A DynamoDB table stand-in with the operations used by the collectors.
+    Queries are equality matches on any attributes and return every match in one page.
+    """
+
+    def __init__(self, name):
+        """
+        Create an empty table with the key of the named collector table.
+        """
+        self.name = name
+        self.key_names = TABLE_KEYS[name]
+        self.items = {}
+
+    def key(self, item):
+        """
+        Return the primary key tuple of an item or key.
+        """
+        return tuple(item[name] for name in self.key_names)
+
+    def put_item(self, Item, **_):  # pylint: disable=invalid-name
+        """
+        Store a copy of an item.
+        """
+        CALLS[("dynamodb", self.name, "put_item")] += 1
+        self.items[self.key(Item)] = copy.deepcopy(Item)
+        return {}
+
+    def get_item(self, Key, **_):  # pylint: disable=invalid-name
+        """
+        Return a copy of the item with a key, if any.
+        """
+        CALLS[("dynamodb", self.name, "get_item")] += 1
+        item = self.items.get(self.key(Key))
+        return {"Item": copy.deepcopy(item)} if item else {}
+
+    def query(self, KeyConditionExpression, **_):  # pylint: disable=invalid-name
+        """
+        Return copies of the items matching an equality key condition, as one page.
+        """
+        CALLS[("dynamodb", self.name, "query")] += 1
+        values = condition_values(KeyConditionExpression)
+        matches = [copy.deepcopy(item) for item in self.items.values() if all(item.get(name) == value for name, value in values.items())]
+        return {"Items": matches}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ConditionExpression=None, ExpressionAttributeNames=None, **_):  # pylint: disable=invalid-name
+        """
+        Apply an update expression to an item. Any condition is treated as requiring the item to exist.
+        """
+        CALLS[("dynamodb", self.name, "update_item")] += 1
+        key = self.key(Key)
+        if ConditionExpression is not None and key not in self.items:
+            raise conditional_check_failed("UpdateItem")
+        item = self.items.setdefault(key, dict(Key))
+        names = ExpressionAttributeNames or {}
+        # only SET name = :value assignments and ADD name :number clauses are supported
+        clauses = re.split(r"\b(SET|ADD)\b", UpdateExpression)
+        for action, body in zip(clauses[1::2], clauses[2::2]):
+            for part in body.split(","):
+                if action == "SET":
+                    name, value = [token.strip() for token in part.split("=")]
+                    item[names.get(name, name)] = ExpressionAttributeValues[value]
+                else:
+                    name, value = part.split()
+                    item[names.get(name, name)] = item.get(names.get(name, name), 0) + ExpressionAttributeValues[value]
+        return {}
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        """
+        Return a batch writer for this table.
+        """
+        return MemoryBatchWriter(self, overwrite_by_pkeys)
+
+
+class MemoryDynamoDB:
+    """
+    A DynamoDB resource stand-in holding the collector tables.
+    """
+
+    def __init__(self):
+        """
+        Create the empty collector tables.
+        """
+        self.tables = {name: MemoryTable(name) for name in TABLE_KEYS}
+        # the alarm collector updates rows through the resource's client
+        self.meta = self
+        self.client = self
+
+    def Table(self, name):  # pylint: disable=invalid-name
+        """
+        Return a table by name.
+        """
+        return self.tables[name]
+
+    def update_item(self, TableName, **arguments):  # pylint: disable=invalid-name
+        """
+        Update an item of a table, as the low-level client does.
+        """
+        return self.tables[TableName].update_item(**arguments)
+
+
+class MemoryCloudWatch:  # pylint: disable=too-few-public-methods
+    """
+    A CloudWatch client stand-in that reports every alarm in the ALARM state.
+    """
+
+    def describe_alarms(self, AlarmNames, **_):  # pylint: disable=invalid-name
+        """
+        Describe the named alarms.
+        """
+        CALLS[("cloudwatch", "", "describe_alarms")] += 1
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return {"CompositeAlarms": [], "MetricAlarms": [{"AlarmName": name, "StateValue": "ALARM", "StateUpdatedTimestamp": now} for name in AlarmNames]}
+
+
+class MemoryMediaPackage:  # pylint: disable=too-few-public-methods
+    """
+    A MediaPackage client stand-in that derives endpoint ARNs from their ids.
+    """
+
+    def describe_origin_endpoint(self, Id):  # pylint: disable=invalid-name
+        """
+        Describe an origin endpoint.
+        """
+        CALLS[("mediapackage", "", "describe_origin_endpoint")] += 1
+        return {"Id": Id, "Arn": "arn:aws:mediapackage:us-west-2:123456789012:origin_endpoints/{}".format(Id)}
+
+
+DYNAMODB = MemoryDynamoDB()
+CLIENTS = {"cloudwatch": MemoryCloudWatch(), "mediapackage": MemoryMediaPackage()}
+
+# route the collectors' boto3 calls to the stand-ins before importing them
+boto3.resource = lambda service_name, **_: DYNAMODB
+boto3.client = lambda service_name, **_: CLIENTS[service_name]
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api", "events"))
+
+import cloudwatch_alarm  # pylint: disable=wrong-import-position,import-error
+import media_events  # pylint: disable=wrong-import-position,import-error
+
+
+def seed_tables(events, subscribers):
+    """
+    Subscribe nodes to every alarm in the corpus and cache every MediaLive channel as a standard channel.
+    """
+    for event in events:
+        if event["source"] == "aws.cloudwatch":
+            region_alarm_name = "{}:{}".format(event["region"], event["detail"]["alarmName"])
+            for index in range(subscribers):
+                resource_arn = "arn:aws:medialive:{}:123456789012:channel:{}".format(event["region"], index)
+                DYNAMODB.tables["alarms"].items[(region_alarm_name, resource_arn)] = {"RegionAlarmName": region_alarm_name, "ResourceArn": resource_arn}
+        elif event["source"] == "aws.medialive" and event["detail"].get("channel_arn"):
+            arn = event["detail"]["channel_arn"]
+            DYNAMODB.tables["content"].items[(arn,)] = {"arn": arn, "service": "medialive-channel", "region": event["region"], "channel_class": "STANDARD", "data": "{}"}
+
+
+def replay(events, queue_batch):
+    """
+    Run the events through the handlers, media events optionally in SQS batches. Returns elapsed seconds.
+    """
+    media = []
+    elapsed = 0.0
+    for event in events:
+        if event["source"] == "aws.cloudwatch":
+            start = time.perf_counter()
+            cloudwatch_alarm.lambda_handler(event, None)
+            elapsed = elapsed + time.perf_counter() - start
+        elif queue_batch:
+            media.append({"messageId": event["id"], "body": json.dumps(event)})
+            if len(media) == queue_batch:
+                start = time.perf_counter()
+                media_events.queue_handler({"Records": media}, None)
+                elapsed = elapsed + time.perf_counter() - start
+                media = []
+        else:
+            start = time.perf_counter()
+            media_events.lambda_handler(event, None)
+            elapsed = elapsed + time.perf_counter() - start
+    if media:
+        start = time.perf_counter()
+        media_events.queue_handler({"Records": media}, None)
+        elapsed = elapsed + time.perf_counter() - start
+    return elapsed
+
+
+def main():
+    """
+    Parse arguments, replay the corpus and print the report.
+    """
+    parser = argparse.ArgumentParser(description='Replay an event corpus through the event collector Lambdas with in-memory backends.')
+    parser.add_argument('corpus', help='JSONL file of EventBridge events')
+    parser.add_argument('--queue-batch', type=int, default=0, help='replay media events through the SQS handler in batches of this size (default 0, one event per invocation)')
+    parser.add_argument('--subscribers', type=int, default=10, help='nodes subscribed to each alarm in the corpus (default 10)')
+    parser.add_argument('--dump', action='store_true', help='print the resulting table items as JSON lines')
+    parser.add_argument('--verbose', action='store_true', help='show the handlers\' own output')
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as corpus:
+        events = [json.loads(line) for line in corpus if line.strip()]
+    seed_tables(events, args.subscribers)
+    CALLS.clear()
+    output = sys.stdout if args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(output):
+        elapsed = replay(copy.deepcopy(events), args.queue_batch)
+
+    sources = collections.Counter(event["source"] for event in events)
+    print("events: {} ({})".format(len(events), ", ".join("{} {}".format(source, count) for source, count in sorted(sources.items()))))
+    print("elapsed: {:.3f}s, {:.0f} events per second".format(elapsed, len(events) / elapsed if elapsed else 0))
+    print("backend calls per event:")
+    for (service, table, operation), count in sorted(CALLS.items()):
+        print("  {:<12} {:<18} {:<26} {:>8} {:.3f}".format(service, table, operation, count, count / len(events)))
+    print("table items:")
+    for name, table in sorted(DYNAMODB.tables.items()):
+        print("  {:<18} {}".format(name, len(table.items)))
+    if args.dump:
+        for name, table in sorted(DYNAMODB.tables.items()):
+            for item in table.items.values():
+                print(json.dumps({"table": name, "item": item}, default=str))
+
+
+if __name__ == "__main__":
+    main()